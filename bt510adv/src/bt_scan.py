@@ -13,6 +13,8 @@ import struct
 import asyncio
 import aioserial
 import time
+from line_reader import LineReader
+from publisher import Publisher
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +28,9 @@ SREG_STORE_CMD = 'AT&W'
 
 RESET_CMD = 'ATZ\r'
 
+# How often the UART read rates and publisher stats are logged while scanning
+STATS_INTERVAL = 60
+
 SREGISTER_VALUES = [
     (211, 80),  # Scan interval
     (212, 80)   # Scan window
@@ -64,17 +69,22 @@ async def cmd(inst, req_str, timeout=3):
     logger.debug('Command {} response: {}'.format(req_str, resp))
     return resp
 
-async def scan(inst, client, scan_timeout):
+async def scan(inst, client, publisher, scan_timeout):
     timeout = scan_timeout if scan_timeout is not None else 0
     logger.info('Starting LE scan for' + ('ever' if timeout == 0 else ' {} seconds'.format(timeout)))
     resp = await cmd(inst, BT_SCAN_FORMAT)
     # Don't await the 'OK' since scan results can return first
     resp = await cmd(inst, BT_SCAN_CMD.format(int(timeout)), 0)
+    inst.timeout = None
+    reader = LineReader(inst, '\r'.encode())
+    logged = time.monotonic()
     while True:
-        inst.timeout = None
-        resp_bytes = (await inst.read_until_async('\r'.encode()))
+        resp_bytes = await reader.readline()
         if len(resp_bytes) == 0:
             return
+        if time.monotonic() - logged > STATS_INTERVAL:
+            logged = time.monotonic()
+            logger.info('UART {} publisher {}'.format(reader.stats(), publisher.stats()))
         logger.debug('Raw adv: {}'.format(resp_bytes))
         try:
             resp = resp_bytes.decode('utf-8').lstrip()
@@ -83,7 +93,8 @@ async def scan(inst, client, scan_timeout):
                 adv, mac = parse_adv(resp)
                 if adv:
                     logger.info('Publishing advertisement: {}'.format(adv))
-                    client.publish(adv, mac)
+                    # Never waits, the oldest advertisement is dropped if the cloud falls behind
+                    publisher.submit(client.publish, adv, mac)
             elif resp.startswith('OK'):
                 pass
             else:
@@ -93,10 +104,10 @@ async def scan(inst, client, scan_timeout):
         except Exception as e:
             logger.warning(f'scan failed {e}')
 
-async def scan_and_filter(inst, client, scan_timeout=None):
+async def scan_and_filter(inst, client, publisher, scan_timeout=None):
     while True:
         try:
-            await asyncio.wait_for(scan(inst, client, scan_timeout), scan_timeout)
+            await asyncio.wait_for(scan(inst, client, publisher, scan_timeout), scan_timeout)
         except asyncio.TimeoutError:
             logger.info('Scan complete')
 
@@ -118,8 +129,10 @@ async def task_main(port, baudrate, client):
     # Start app again
     await cmd(inst, APP_CMD)
     await cmd(inst, '')
+    # Publishes run on their own threads, off the loop reading the UART
+    publisher = Publisher()
     # Start the scanning task
-    asyncio.create_task(scan_and_filter(inst, client))
+    asyncio.create_task(scan_and_filter(inst, client, publisher))
     while True:
         ## this will allow developers to have a responsive ctr-C
         await asyncio.sleep(1)
@@ -0,0 +1,180 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 2
+QUEUE_SIZE = 64
+#what submit() does with a full queue
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class PublishDropped(Exception):
+    pass
+
+
+class Publisher():
+    """ runs client publishes, and the payload encoding in them, on a small thread pool
+
+    The greengrass client blocks, and encoding a large log takes a while. Neither may
+    hold up the event loop that services the UART. Publishes wait in a bounded queue:
+    put() waits for room, submit() never waits and drops by the policy when the queue
+    is full. Both return a future with the result of the publish. The workers start
+    with the first publish, in the running loop. """
+    def __init__(self,
+                 workers: int = WORKERS,
+                 maxsize: int = QUEUE_SIZE,
+                 policy: str = DROP_OLDEST):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="publish")
+        self.queue = None
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.run_sum = 0.0
+        self.depth_max = 0
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        for _ in range(self.workers):
+            asyncio.create_task(self._worker())
+
+    def _job(self, fn, args) -> tuple:
+        if self.queue is None:
+            self.start()
+        return (fn, args, asyncio.get_running_loop().create_future(),
+                time.monotonic())
+
+    def _queued(self):
+        depth = self.queue.qsize()
+        if depth > self.depth_max:
+            self.depth_max = depth
+
+    async def put(self, fn, *args) -> asyncio.Future:
+        """ queue fn(*args), waiting while the queue is full """
+        job = self._job(fn, args)
+        await self.queue.put(job)
+        self._queued()
+        return job[2]
+
+    def submit(self, fn, *args, policy: str = None) -> asyncio.Future:
+        """ queue fn(*args) without waiting, a full queue drops by the policy. A
+        policy given here is for this publish only, DROP_NEWEST never displaces a
+        queued one """
+        job = self._job(fn, args)
+        if self.queue.full():
+            if (policy or self.policy) == DROP_NEWEST:
+                self._drop(job, policy or self.policy)
+                return job[2]
+            self._drop(self.queue.get_nowait(), policy or self.policy)
+            self.queue.task_done()
+        self.queue.put_nowait(job)
+        self._queued()
+        return job[2]
+
+    def _drop(self, job: tuple, policy: str):
+        if not self.dropped:
+            logger.warning(f"publish queue full, {policy}")
+        self.dropped += 1
+        job[2].set_exception(PublishDropped(policy))
+        #nobody may be waiting on the future
+        job[2].exception()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            (fn, args, done, queued) = await self.queue.get()
+            start = time.monotonic()
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"publish failed {e}")
+                if not done.cancelled():
+                    done.set_exception(e)
+                    done.exception()
+            else:
+                self.published += 1
+                if not done.cancelled():
+                    done.set_result(result)
+            finally:
+                self.queue.task_done()
+            end = time.monotonic()
+            self.window_count += 1
+            self.latency_sum += end - queued
+            self.latency_max = max(self.latency_max, end - queued)
+            self.run_sum += end - start
+
+    def stats(self) -> dict:
+        """ totals, and the latencies and deepest queue since the last call """
+        count = max(self.window_count, 1)
+        stats = {
+            "depth": self.queue.qsize() if self.queue else 0,
+            "depth_max": self.depth_max,
+            "published": self.published,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "latency_ms": round(self.latency_sum / count * 1000, 1),
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+            "publish_ms": round(self.run_sum / count * 1000, 1)
+        }
+        self._reset_window()
+        return stats
+
+
+if __name__ == "__main__":
+    import threading
+
+    def slow_publish(payload: bytes):
+        #a blocking client call
+        time.sleep(0.02)
+        return len(payload)
+
+    async def main():
+        publisher = Publisher(maxsize=8)
+        #the loop keeps ticking while the publishes block their threads
+        ticks = 0
+        stop = asyncio.Event()
+
+        async def tick():
+            nonlocal ticks
+            while not stop.is_set():
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        asyncio.create_task(tick())
+        futures = [publisher.submit(slow_publish, bytes(i)) for i in range(20)]
+        await publisher.queue.join()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        dropped = [r for r in results if isinstance(r, PublishDropped)]
+        assert len(dropped) == 12 and results[-1] == 19, results
+        assert await (await publisher.put(slow_publish, b"abc")) == 3
+        #a full queue keeps what is queued for a DROP_NEWEST submit
+        kept = [await publisher.put(slow_publish, bytes(i)) for i in range(8)]
+        extra = publisher.submit(slow_publish, b"", policy=DROP_NEWEST)
+        assert isinstance(extra.exception(), PublishDropped)
+        assert [await k for k in kept] == list(range(8))
+        stop.set()
+        print(f"ticks {ticks} threads {threading.active_count()} {publisher.stats()}")
+
+    asyncio.run(main())
@@ -6,6 +6,7 @@ for /d /r %%i in (deploy\*.dist-info) do @rmdir /s /q "%%i"
 for /d /r %%i in (deploy\__pycache__) do @rmdir /s /q "%%i"
 del /s /f /q deploy\*.pyc
 rmdir /s /q deploy\asyncio
+rmdir /s /q deploy\bench
 pushd deploy
 zip -r ..\lambda_deploy.zip *
 popd
\ No newline at end of file
@@ -3,5 +3,6 @@ pip install -r requirements.txt --target ./deploy
 rm -rf deploy/asyncio
 cp -r src/* deploy
 rm -rf deploy/test
+rm -rf deploy/bench
 rm -rf deploy/*.dist-info
 cd deploy ; zip -r ../lambda_deploy.zip * ; cd ../
@@ -12,13 +12,23 @@ import json
 import os
 import platform
 from contact_tracing.tasks import task_main
-from contact_tracing.decision import establish_targets
+from contact_tracing.decision import establish_targets, establish_max_con, establish_scheduler, establish_backoff
 from contact_tracing.btx10ct import Bt510Ct
+from contact_tracing.device_state import DeviceStore
+from contact_tracing.outbox import Outbox
+from publisher import Publisher
+from contact_tracing.compression import compressor_from_options
+from contact_tracing.exposure import summarizer_from_options
+from contact_tracing.metrics import establish_metrics
 
 from bt_manager import startup
 
 DEFAULT_ID = '000000000000001'
 
+config_file = "ct_app.json"
+with open(config_file, 'r') as fp:
+    config = json.load(fp)
+
 # Set up logging
 if __name__ == "__main__":
     port = config["bl654_port"]
@@ -53,10 +63,6 @@ else:
 
 client = Client(id)
 
-config_file = "ct_app.json"
-with open(config_file, 'r') as fp:
-    config = json.load(fp)
-
 logger.info(config)
 
 def apply_config(config):
@@ -64,14 +70,40 @@ def apply_config(config):
     logger.info(config)
     startup(port, config["sb_app"], config["sb_app_folder"], config["sb_at"])
     establish_targets(config["decision"]["targets"])
+    establish_max_con(config["decision"].get("max_con", 1))
+    establish_scheduler(config["decision"].get("starvation_s"))
+    establish_backoff(config["decision"].get("failure_budget"),
+                      config["decision"].get("quarantine_s"))
+    metrics = config.get("metrics") or {}
+    establish_metrics(metrics.get("interval_s"), metrics.get("dump_path"))
 
     Bt510Ct.set_payload_format(config["payload_format"])
+    payload_options = config.get("payload_options") or {}
+    compressor = compressor_from_options(payload_options)
+    if compressor and config["payload_format"] == "mg100":
+        #the MG100 protocol has no content encoding
+        logger.warning("mg100 payloads are not compressed")
+    client.set_compressor(compressor)
+    client.set_page_bytes(payload_options.get("page_bytes"))
+    client.set_summarizer(summarizer_from_options(config.get("summary")))
+    Bt510Ct.set_smp_window(config.get("smp_window", 1))
+    Bt510Ct.set_store(DeviceStore(config.get("state_dir")))
+    Bt510Ct.set_incremental(config.get("incremental", False))
+    if config.get("outbox_dir"):
+        Bt510Ct.set_outbox(
+            Outbox(config["outbox_dir"],
+                   max_bytes=config.get("outbox_max_mb", 64) * 1024 * 1024,
+                   max_attempts=config.get("outbox_max_attempts", 12)))
     Bt510Ct.set_client(client)
+    Bt510Ct.set_publisher(
+        Publisher(config.get("publish_workers", 2),
+                  config.get("publish_queue", 64)))
     client.status(f"startup - {config['sb_app']} ")
 
 
 apply_config(config)
-asyncio.run(task_main(port, config["baudrate_str"]))
+asyncio.run(
+    task_main(port, config["baudrate_str"], config.get("uart_transcript")))
 
 
 def handler():
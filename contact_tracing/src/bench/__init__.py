@@ -0,0 +1,8 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
@@ -0,0 +1,221 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Replays a UART transcript through each stage of the pipeline at full speed and
+# reports ops/sec, latency percentiles and peak memory, from the src folder:
+#
+#   python -m bench                              synthetic transcript and logs
+#   python -m bench --transcript uart.log        lines recorded by uart_transcript
+#   python -m bench --json now.json --compare before.json
+#
+# --compare exits with 1 when a stage lost more than --tolerance of its ops/sec.
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from collections import OrderedDict
+import sb.adv as bt_adv
+import sb.response as bt_resp
+from contact_tracing.smp import SmpFileResp, LOG_CT
+from contact_tracing.router import Router
+from contact_tracing.log_file import DataLog, DataLogStream
+from contact_tracing.tracker_log import CtFile, CtFileStream
+from contact_tracing.exposure import ExposureSummarizer
+from contact_tracing.compression import PayloadCompressor, template_dictionary
+from . import synth
+
+#bytes per on_data call when a log is streamed, about one SMP response
+STREAM_PIECE = 200
+
+
+def load(path: str) -> list:
+    with open(path, 'rb') as fp:
+        return [line for line in fp.read().splitlines(keepends=True) if line.strip()]
+
+
+def downloads(lines: list) -> list:
+    """ the evt_hvx lines of each download in a transcript, connA to dconnH """
+    open_files = {}
+    done = []
+    for line in lines:
+        if line.startswith(b"connA:"):
+            open_files[line.split()[1][:8]] = []
+        elif line.startswith(b"evt_hvx:"):
+            notifications = open_files.get(line[8:16])
+            if notifications is not None:
+                notifications.append(line.decode())
+        elif line.startswith(b"dconnH:"):
+            notifications = open_files.pop(line[7:15], None)
+            if notifications:
+                done.append(notifications)
+    return done
+
+
+def reassemble(notifications: list) -> bytes:
+    """ the requests are not in a transcript, each response is taken as outstanding """
+    file = SmpFileResp("bench", LOG_CT)
+    for line in notifications:
+        data = bt_resp.sb_notif_decode(line)[2]
+        if file.new and len(data) > 6:
+            file.outstanding[data[6]] = 0
+            file.sent[data[6]] = time.monotonic()
+        file.data(data)
+    return bytes(file.read()) if file.is_complete() else None
+
+
+class Sink():
+    """ a device that takes everything the router gives it """
+    def get_queue(self):
+        return self
+
+    def put_line(self, item):
+        pass
+
+
+def stream(cls, log: bytes):
+    s = cls()
+    for off in range(0, len(log), STREAM_PIECE):
+        s.feed(log[off:off + STREAM_PIECE])
+    return s.result(log)
+
+
+def percentile(sorted_ns: list, q: float) -> float:
+    return sorted_ns[min(len(sorted_ns) - 1, int(q * len(sorted_ns)))] / 1000
+
+
+def measure(fn, items: list, min_time: float) -> dict:
+    """ fn on every item, repeated for at least min_time, then once more for the peak
+    memory """
+    times = []
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            t = time.perf_counter_ns()
+            fn(item)
+            times.append(time.perf_counter_ns() - t)
+        if time.perf_counter() - start >= min_time:
+            break
+    times.sort()
+    tracemalloc.start()
+    for item in items:
+        fn(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return OrderedDict([
+        ("ops", len(times)),
+        ("ops_per_sec", round(len(times) / (sum(times) / 1e9), 1)),
+        ("p50_us", round(percentile(times, 0.5), 1)),
+        ("p90_us", round(percentile(times, 0.9), 1)),
+        ("p99_us", round(percentile(times, 0.99), 1)),
+        ("max_us", round(times[-1] / 1000, 1)),
+        ("peak_kb", round(peak / 1024, 1)),
+    ])
+
+
+def stages(lines: list, logs: list) -> OrderedDict:
+    """ name -> (fn, items) """
+    adverts = [line for line in lines if line.startswith(b"adv:")]
+    responses = [
+        line.decode() for line in lines
+        if not line.startswith(b"adv:") and not line.startswith(b"scan:")
+    ]
+    router = Router()
+    for line in responses:
+        if line.startswith("connA:"):
+            router.register(line[6:20], Sink())
+            router.route(line, "")
+    legacy = [line for line in responses if line.split(":")[0] in bt_resp.sb_conn_resp]
+    files = downloads(lines)
+    ct_files = [CtFile(log) for log in logs]
+    data_logs = [DataLog(log) for log in logs]
+    summarizer = ExposureSummarizer()
+    deflate = PayloadCompressor("deflate", 6, template_dictionary())
+    docs = [f.serialize().encode() for f in ct_files]
+    return OrderedDict([
+        ("adv.handler", (bt_adv.handler, adverts)),
+        ("router.route", (lambda line: router.route(line, ""), responses)),
+        ("response.handle_resp", (lambda line: bt_resp.handle_resp(line, ""), legacy)),
+        ("smp.reassemble", (reassemble, files)),
+        ("DataLog parse", (DataLog, logs)),
+        ("CtFile parse", (CtFile, logs)),
+        ("DataLogStream", (lambda log: stream(DataLogStream, log), logs)),
+        ("CtFileStream", (lambda log: stream(CtFileStream, log), logs)),
+        ("DataLog serialize", (lambda log: log.serialize(), data_logs)),
+        ("CtFile serialize", (lambda f: f.serialize(), ct_files)),
+        ("CtFile pages 64k", (lambda f: list(f.pages("bench", 65536)), ct_files)),
+        ("exposure summary", (summarizer.serialize, ct_files)),
+        ("deflate", (deflate.compress, docs)),
+    ])
+
+
+def run(lines: list, logs: list, only: str, min_time: float) -> OrderedDict:
+    results = OrderedDict()
+    for (name, (fn, items)) in stages(lines, logs).items():
+        if only and only not in name:
+            continue
+        if not items:
+            print(f"{name:22} nothing in the transcript")
+            continue
+        result = measure(fn, items, min_time)
+        results[name] = result
+        print(f"{name:22} {result['ops_per_sec']:12.1f}/s  p50 {result['p50_us']:10.1f}"
+              f"  p90 {result['p90_us']:10.1f}  p99 {result['p99_us']:10.1f} us"
+              f"  peak {result['peak_kb']:9.1f} kB")
+    return results
+
+
+def compare(results: OrderedDict, path: str, tolerance: float) -> bool:
+    with open(path, 'r') as fp:
+        baseline = json.load(fp)["stages"]
+    ok = True
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        slower = ratio < 1 - tolerance
+        ok = ok and not slower
+        print(f"{name:22} {ratio:6.2f}x {'REGRESSION' if slower else ''}")
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("--transcript", help="recorded UART lines")
+    parser.add_argument("--entries", type=int, default=3000,
+                        help="entries of the synthetic logs")
+    parser.add_argument("--logs", type=int, default=3, help="synthetic logs")
+    parser.add_argument("--stage", help="only the stages with this in their name")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds each stage runs at least")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    lines = load(args.transcript) if args.transcript else synth.transcript()
+    logs = [log for log in map(reassemble, downloads(lines)) if log]
+    #the logs of the transcript, and big synthetic ones
+    logs += [synth.ct_log(args.entries, seed=i) for i in range(args.logs)]
+    print(f"{len(lines)} lines, {len(logs)} logs of "
+          f"{sum(map(len, logs)) // max(len(logs), 1)} bytes on average")
+    results = run(lines, logs, args.stage, args.min_time)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({"python": platform.python_version(), "stages": results}, fp,
+                      indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
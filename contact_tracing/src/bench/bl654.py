@@ -0,0 +1,366 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# A simulated BL654 running smp.cmd.sb on a pseudo terminal, with virtual BT710 tags
+# serving /log/ct, for load tests without hardware. From the src folder:
+#
+#   python -m bench.bl654 --tags 300 --max-con 8 --loss 0.01 --link /tmp/ttyBL654
+#
+# then point bl654_port of ct_app.json at the link (or the printed pty) and run
+# python app.py, it publishes with LocalPrint. The at commands of bt_manager.startup
+# are answered as by a module with the app loaded. Output to the app is paced at
+# --baud.
+# NOTE: the line formats are SmartBasic specific, see sb_smp/smp.cmd.sb
+import os
+import sys
+import pty
+import tty
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import Counter
+import cbor
+from sb.adv import HAS_LOG_DATA, HAS_EPOCH_TIME
+from contact_tracing.smp import LOG_CT
+from . import synth
+
+logger = logging.getLogger(__name__)
+
+#start and stop bits
+BITS_PER_BYTE = 10
+#most bytes written to the pty at once
+MAX_WRITE = 4096
+#ATT header of a notification, the rest of the MTU is data
+ATT_HEADER = 3
+#time between the notifications of one link, the connection interval
+NOTIFY_INTERVAL = 0.0075
+#rc printed when all connections are in use, the app only looks at the ## prefix
+CONNECT_LIMIT_RC = 0x6054
+#SMP rc of a read of a file the tag does not have
+SMP_ENOENT = 5
+REPORT_INTERVAL = 10
+#replies of the module to the at commands of bt_manager
+AT_REPLIES = {
+    "ati 3": "\n10\t3\t29.4.6.0\r\n00\r",
+    "ati 13": "\n10\t13\t7580 E959\r\n00\r",
+}
+AT_OK = "\n00\r"
+APP_BANNER = "cmd: 1D040600 00000001 0.1 \n"
+
+
+class Tag():
+    """ a virtual BT710, its device id is its address. It has log data until a
+    download reaches the end of its log. refill_s after that it has added up to a
+    quarter of its first entries to the log """
+    __slots__ = ('mac', 'rssi', 'entries', 'seed', 'log', 'has_data', 'refill_at')
+
+    def __init__(self, mac: str, rssi: int, entries: int, seed: int):
+        self.mac = mac
+        self.rssi = rssi
+        self.entries = entries
+        self.seed = seed
+        self.log = synth.ct_log(entries, seed=seed, device_id=bytes.fromhex(mac[2:]))
+        self.has_data = True
+        self.refill_at = None
+
+    def downloaded(self, refill_at: float):
+        self.has_data = False
+        self.refill_at = refill_at
+
+    def refill(self, now: float):
+        if not self.has_data and now >= self.refill_at:
+            self.seed += 1
+            added = random.Random(self.seed).randint(1, self.entries // 4 + 1)
+            self.log = synth.append_entries(self.log, added, seed=self.seed)
+            self.has_data = True
+
+
+class Link():
+    __slots__ = ('tag', 'busy_until', 'complete')
+
+    def __init__(self, tag: Tag):
+        self.tag = tag
+        #the last notification of the link is sent by then
+        self.busy_until = 0.0
+        self.complete = False
+
+
+class Bl654():
+    """ the commands of smp.cmd.sb against the virtual tags. latency is the time
+    from a command to its first response, loss the chance a connect times out or an
+    SMP request gets no response """
+    def __init__(self,
+                 tags: list,
+                 mtu: int = synth.MTU,
+                 chunk: int = synth.CHUNK,
+                 latency: float = 0.02,
+                 loss: float = 0.0,
+                 baud: int = 921600,
+                 max_con: int = 8,
+                 adv_interval: float = 1.0,
+                 refill_s: float = 60,
+                 seed: int = 1):
+        self.tags = {tag.mac: tag for tag in tags}
+        self.mtu = mtu
+        self.chunk = chunk
+        self.latency = latency
+        self.loss = loss
+        self.baud = baud
+        self.max_con = max_con
+        self.adv_interval = adv_interval
+        self.refill_s = refill_s
+        self.rand = random.Random(seed)
+        self.links = {}
+        self.next_handle = 0x0001FF00
+        self.rx = b""
+        self.stats = Counter()
+
+    async def run(self, fd: int):
+        self.fd = fd
+        self.loop = asyncio.get_running_loop()
+        self.out = asyncio.Queue()
+        self.loop.add_reader(fd, self._readable)
+        asyncio.create_task(self._report())
+        await self._writer()
+
+    def _send(self, line):
+        if isinstance(line, str):
+            line = line.encode()
+        self.out.put_nowait(line)
+
+    def _later(self, delay: float, line):
+        self.loop.call_later(delay, self._send, line)
+
+    async def _writer(self):
+        """ everything the module prints, no faster than the UART """
+        deadline = time.monotonic()
+        while True:
+            data = [await self.out.get()]
+            size = len(data[0])
+            while size < MAX_WRITE and not self.out.empty():
+                data.append(self.out.get_nowait())
+                size += len(data[-1])
+            view = memoryview(b"".join(data))
+            while view:
+                try:
+                    view = view[os.write(self.fd, view):]
+                except BlockingIOError:
+                    #the app is not reading, as with CTS low
+                    self.stats["uart_stalls"] += 1
+                    await asyncio.sleep(0.001)
+            self.stats["uart_bytes"] += size
+            deadline = max(deadline, time.monotonic()) + size * BITS_PER_BYTE / self.baud
+            await asyncio.sleep(deadline - time.monotonic())
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            stats = dict(self.stats)
+            uart = stats.pop("uart_bytes", 0)
+            self.stats.clear()
+            logger.info(f"links {len(self.links)} uart {uart // REPORT_INTERVAL} B/s "
+                        f"{stats}")
+
+    def _readable(self):
+        try:
+            data = os.read(self.fd, MAX_WRITE)
+        except BlockingIOError:
+            return
+        except OSError:
+            #EIO while no one has the pty open
+            return
+        self.rx += data
+        self._commands()
+
+    def _commands(self):
+        """ commands end with a CR, the data of writecmdx is binary and may have one """
+        while True:
+            self.rx = self.rx.lstrip(b"\r\n")
+            if self.rx.startswith(b"gattc writecmdx "):
+                parts = self.rx.split(b" ", 4)
+                if len(parts) < 5:
+                    return
+                length = int(parts[3])
+                end = parts[4].find(b"\r", length)
+                if end < 0:
+                    return
+                self._write(int(parts[2]), parts[4][:length])
+                self.rx = parts[4][end + 1:]
+                continue
+            end = self.rx.find(b"\r")
+            if end < 0:
+                return
+            cmd = self.rx[:end].decode("ascii", errors="replace")
+            self.rx = self.rx[end + 1:]
+            self._command(cmd.split())
+
+    def _command(self, tokens: list):
+        if not tokens:
+            return
+        name = tokens[0].lower()
+        if name.startswith("at"):
+            self._at(" ".join(tokens).lower())
+        elif name == "scan" and tokens[1:2] == ["start"]:
+            self._scan(int(tokens[2]) / 1000)
+        elif name == "connect" and len(tokens) >= 3:
+            self._connect(tokens[1].upper(), int(tokens[2]) / 1000)
+        elif name == "disconnect":
+            self._disconnect(int(tokens[1]))
+        elif name == "adv":
+            #the gateway advertising the time, nothing to simulate
+            pass
+        else:
+            logger.debug(f"unsupported command {tokens}")
+
+    def _at(self, cmd: str):
+        self._send(AT_REPLIES.get(cmd, AT_OK))
+        if cmd.startswith("at+run"):
+            self._send(APP_BANNER)
+
+    def _scan(self, window: float):
+        """ each tag advertises every adv_interval, so is heard in a window with
+        window / adv_interval odds """
+        heard = min(1.0, window / self.adv_interval) * (1 - self.loss)
+        for tag in self.tags.values():
+            if self.rand.random() < heard:
+                self.loop.call_later(self.rand.random() * window, self._advert, tag)
+        self._later(window, b"scan:timeout\n")
+
+    def _advert(self, tag: Tag):
+        tag.refill(time.monotonic())
+        flags = HAS_EPOCH_TIME | (HAS_LOG_DATA if tag.has_data else 0)
+        self._send(synth.adv_line(tag.mac, tag.rssi + self.rand.randint(-4, 4), flags))
+        self.stats["adverts"] += 1
+
+    def _connect(self, mac: str, timeout: float):
+        tag = self.tags.get(mac)
+        if len(self.links) >= self.max_con:
+            self._send(f"##ble Connect error {mac} {CONNECT_LIMIT_RC:08X}\n")
+            self.stats["connect_refused"] += 1
+            return
+        if not tag or self.rand.random() < self.loss:
+            self._later(timeout, b"dconnTO\n")
+            self.stats["connect_timeouts"] += 1
+            return
+        handle = self.next_handle
+        self.next_handle += 1
+        self.links[handle] = Link(tag)
+        self._later(self.latency, f"connA:{mac} {handle:08X}\n")
+        #notifications enabled, see HandlerPacketLength
+        self._later(2 * self.latency, f"writec:{handle:08X} 19\n")
+        self.stats["connects"] += 1
+
+    def _write(self, handle: int, pkt: bytes):
+        """ an SMP request, answered with notifications of up to mtu bytes """
+        link = self.links.get(handle)
+        if not link:
+            self._send(f"## writexE:{handle} 6\n")
+            return
+        if self.rand.random() < self.loss:
+            self.stats["requests_lost"] += 1
+            return
+        try:
+            (_, _, length, group, seq, cmd_id) = synth.SMP_HEADER.unpack_from(pkt)
+            req = cbor.loads(pkt[synth.SMP_HEADER.size:synth.SMP_HEADER.size + length])
+        except Exception as e:
+            logger.warning(f"bad SMP request on {handle:08X} {e}")
+            return
+        log = link.tag.log
+        if req.get("name") != LOG_CT:
+            body = cbor.dumps({"rc": SMP_ENOENT})
+            smp = synth.SMP_HEADER.pack(synth.SMP_READ_RSP, 0, len(body), group, seq,
+                                        cmd_id) + body
+        else:
+            off = req.get("off", 0)
+            smp = synth.smp_response(seq, off, log[off:off + self.chunk], len(log))
+            if off + self.chunk >= len(log):
+                link.complete = True
+        now = time.monotonic()
+        start = max(now + self.latency, link.busy_until)
+        for (i, line) in enumerate(
+                synth.notifications(handle, smp, self.mtu - ATT_HEADER)):
+            link.busy_until = start + i * NOTIFY_INTERVAL
+            self._later(link.busy_until - now, line)
+        link.busy_until += NOTIFY_INTERVAL
+        self.stats["requests"] += 1
+
+    def _disconnect(self, handle: int):
+        link = self.links.pop(handle, None)
+        if not link:
+            logger.debug(f"disconnect of unknown handle {handle:08X}")
+            return
+        if link.complete:
+            link.tag.downloaded(time.monotonic() + self.refill_s)
+            self.stats["downloads"] += 1
+        self._later(self.latency, f"dconnH:{handle:08X} \n")
+
+
+def virtual_tags(count: int, entries: int, seed: int = 1) -> list:
+    """ tags with logs of 1 to entries entries, most of them in range """
+    rand = random.Random(seed)
+    return [
+        Tag(mac, rand.randint(-85, -45), rand.randint(1, entries), seed + i)
+        for (i, mac) in enumerate(synth.macs(count, seed))
+    ]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.bl654")
+    parser.add_argument("--tags", type=int, default=100, help="virtual tags")
+    parser.add_argument("--entries", type=int, default=200,
+                        help="most entries of a tag log")
+    parser.add_argument("--mtu", type=int, default=synth.MTU + ATT_HEADER,
+                        help="ATT MTU of the links")
+    parser.add_argument("--chunk", type=int, default=synth.CHUNK,
+                        help="bytes of log in an SMP response")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds from a command to its response")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="chance of a lost advert, connect or SMP request")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--max-con", type=int, default=8,
+                        help="connections the module takes at once")
+    parser.add_argument("--adv-interval", type=float, default=1.0)
+    parser.add_argument("--refill", type=float, default=60,
+                        help="seconds until a downloaded tag has new data")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--link", help="symlink to the pty, for bl654_port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s  %(levelname)s  %(message)s',
+                        level=logging.INFO)
+
+    tags = virtual_tags(args.tags, args.entries, args.seed)
+    module = Bl654(tags, args.mtu, args.chunk, args.latency, args.loss, args.baud,
+                   args.max_con, args.adv_interval, args.refill, args.seed)
+    (master, slave) = pty.openpty()
+    #no echo or newline translation before the app opens the port
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    path = os.ttyname(slave)
+    if args.link:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(path, args.link)
+    print(f"BL654 on {args.link or path}, {len(tags)} tags with "
+          f"{sum(len(t.log) for t in tags) // len(tags)} byte logs on average",
+          flush=True)
+    try:
+        asyncio.run(module.run(master))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Synthetic CT logs and UART transcripts, as the smartBasic app prints them.
+# NOTE: the line formats are SmartBasic specific, see sb_smp/smp.cmd.sb
+import random
+import struct
+import cbor
+from contact_tracing.crc import crc16_kermit
+from contact_tracing.log_file import HEADER_P1, HEADER_P2, ENTRY_HEADER, \
+    ENTRY_HEADER_SIZE, RECORD_FORMAT, CT_RECORD_TYPE, CT_LOG_HEADER_SIZE
+from contact_tracing.smp import cmd_bin, LOG_CT
+
+SMP_HEADER = struct.Struct('>BBHHBB')
+#read response of the fs group, file download
+SMP_READ_RSP = 1
+SMP_GROUP_FS = 8
+SMP_ID_FILE = 0
+CHUNK = 200
+MTU = 244
+DEVICE_ID = bytes.fromhex("c0ffee123456")
+#a BT510 CT advert, flags and the reversed MAC go in the gaps
+ADV_DATA = "0201061BFF770081FFFFFF{flags:02X}00{addr}00004491365F000000000000"
+
+
+def _entries(rand: random.Random, count: int, records: int, contacts: int,
+             start: int) -> bytes:
+    """ count entries with valid CRCs, a minute apart from start """
+    serials = [bytes(rand.randrange(256) for _ in range(6)) for _ in range(contacts)]
+    out = bytearray()
+    for i in range(count):
+        rows = b"".join(
+            RECORD_FORMAT.pack(CT_RECORD_TYPE, 0, 0, j, rand.randint(-95, -40),
+                               rand.randrange(2), rand.randint(-8, 4) & 0xFF)
+            for j in range(rand.randint(1, records)))
+        entry = ENTRY_HEADER.pack(0xA5, 0, 10, rand.choice(serials), start + i * 60,
+                                  ENTRY_HEADER_SIZE + len(rows)) + rows
+        out += entry + struct.pack("<H", crc16_kermit(entry))
+    return bytes(out)
+
+
+def _header(entries: int, device_id: bytes, device_time: int, last_upload: int,
+            contacts: int) -> bytes:
+    header = HEADER_P1.pack(1, 256, entries, device_id, device_time, 0,
+                            last_upload) + HEADER_P2.pack(
+                                bytes.fromhex("01020304"), contacts, 0xFFFF, 1000,
+                                1, 10, 180, 3, 1, -90, 0, 12345)
+    return header + struct.pack("<H", crc16_kermit(header))
+
+
+def ct_log(entries: int = 1000,
+           records: int = 24,
+           contacts: int = 64,
+           seed: int = 1,
+           start: int = 1600000000,
+           device_id: bytes = DEVICE_ID) -> bytes:
+    """ a log with valid CRCs. Each entry has up to records records, from one of
+    contacts remote devices, a minute after the previous one """
+    rand = random.Random(seed)
+    return _header(entries, device_id, start + entries * 60, start - 10000,
+                   contacts) + _entries(rand, entries, records, contacts, start)
+
+
+def append_entries(log: bytes,
+                   entries: int,
+                   records: int = 24,
+                   contacts: int = 64,
+                   seed: int = 1) -> bytes:
+    """ the log with entries more, as a tag adds them. The entry count, device time
+    and CRC of the header change, the header fingerprint stays the same """
+    (_, _, count, device_id, device_time, _, last_upload) = HEADER_P1.unpack_from(log)
+    rand = random.Random(seed)
+    return _header(count + entries, device_id, device_time + entries * 60, last_upload,
+                   contacts) + log[CT_LOG_HEADER_SIZE:] + _entries(
+                       rand, entries, records, contacts, device_time)
+
+
+def adv_line(mac: str, rssi: int = -60, flags: int = 3) -> bytes:
+    """ the scan report of a tag, mac is the 14 character address with its type """
+    addr = "".join(reversed([mac[i:i + 2] for i in range(2, 14, 2)]))
+    data = ADV_DATA.format(flags=flags, addr=addr)
+    return f"adv:{mac} {data} 0 {rssi}\n".encode()
+
+
+def macs(count: int, seed: int = 1) -> list:
+    rand = random.Random(seed)
+    return ["01%012X" % rand.randrange(1 << 48) for _ in range(count)]
+
+
+def scan_window(tags: list, adverts: int, seed: int = 1) -> list:
+    """ adverts scan reports from the tags, then the end of the scan """
+    rand = random.Random(seed)
+    lines = [
+        adv_line(rand.choice(tags), rand.randint(-99, -30), rand.choice((1, 3)))
+        for _ in range(adverts)
+    ]
+    return lines + [b"scan:timeout\n"]
+
+
+def first_seq(file_name: str = LOG_CT) -> int:
+    """ the sequence number of the canned first request, see SmpFileResp """
+    return cmd_bin[file_name][6]
+
+
+def smp_response(seq: int, off: int, data: bytes, file_len: int = None) -> bytes:
+    rsp = {"off": off, "data": data, "rc": 0}
+    if off == 0:
+        rsp["len"] = file_len
+    body = cbor.dumps(rsp)
+    return SMP_HEADER.pack(SMP_READ_RSP, 0, len(body), SMP_GROUP_FS, seq,
+                           SMP_ID_FILE) + body
+
+
+def notifications(handle: int, smp: bytes, mtu: int = MTU) -> list:
+    """ a response as the notifications the BL654 prints for it """
+    return [
+        f"evt_hvx:{handle:08X} 16 {smp[i:i + mtu].hex().upper()}\n".encode()
+        for i in range(0, len(smp), mtu)
+    ]
+
+
+def download(mac: str,
+             handle: int,
+             log: bytes,
+             chunk: int = CHUNK,
+             mtu: int = MTU) -> list:
+    """ the lines of a whole download with a window of one: connect, the file in
+    chunk sized responses, disconnect """
+    lines = [f"connA:{mac} {handle:08X}\n".encode(), f"writec:{handle:08X} 19\n".encode()]
+    seq = first_seq()
+    for off in range(0, len(log), chunk):
+        smp = smp_response(seq, off, log[off:off + chunk], len(log))
+        lines += notifications(handle, smp, mtu)
+        seq = (seq + 1) & 0xFF
+    return lines + [f"dconnH:{handle:08X} \n".encode()]
+
+
+def transcript(tags: int = 8,
+               adverts: int = 200,
+               entries: int = 500,
+               seed: int = 1) -> list:
+    """ a scan window, then a download from each tag """
+    rand = random.Random(seed)
+    lines = []
+    addresses = macs(tags, seed)
+    lines += scan_window(addresses, adverts, seed)
+    for (i, mac) in enumerate(addresses):
+        log = ct_log(rand.randint(1, entries), seed=seed + i)
+        lines += download(mac, 0x10 + i, log)
+    return lines
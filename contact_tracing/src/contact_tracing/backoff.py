@@ -0,0 +1,128 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Keeps tags that keep failing from taking radio time from the healthy ones.
+#
+# After each failed connect or download a tag is held back for an exponentially
+# growing, jittered time. A tag that fails FAILURE_BUDGET times in a row is
+# quarantined. After the quarantine it gets one more try, and a failure quarantines it
+# again. A success clears everything.
+import time
+import random
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+#outcomes of a connection
+OK = "ok"
+CONNECT_FAILED = "connect"
+DOWNLOAD_FAILED = "download"
+
+#first backoff after a failure, a failed download costs more radio time than a connect
+BACKOFF_S = {CONNECT_FAILED: 15, DOWNLOAD_FAILED: 60}
+MAX_BACKOFF_S = 10 * 60
+FAILURE_BUDGET = 6
+QUARANTINE_S = 30 * 60
+#a tag not seen failing for this long after its hold ended has left, it is forgotten
+FORGET_S = 60 * 60
+#tags tracked at once, the ones that failed longest ago are dropped
+MAX_TAGS = 1024
+
+
+class Failures():
+    def __init__(self):
+        self.count = 0
+        self.until = 0
+        self.quarantined = False
+
+
+class FailureTracker():
+    def __init__(self,
+                 failure_budget: int = FAILURE_BUDGET,
+                 quarantine_s: float = QUARANTINE_S,
+                 max_tags: int = MAX_TAGS):
+        self.failure_budget = max(1, failure_budget)
+        self.quarantine_s = quarantine_s
+        self.max_tags = max(1, max_tags)
+        #in the order of the last failure
+        self.tags = OrderedDict()
+
+    def allowed(self, mac: str, now: float = None) -> bool:
+        """ false while the tag is backing off or quarantined """
+        failures = self.tags.get(mac)
+        if not failures:
+            return True
+        if now is None:
+            now = time.time()
+        return now >= failures.until
+
+    def record(self, mac: str, outcome: str, now: float = None):
+        if outcome == OK:
+            if self.tags.pop(mac, None):
+                logger.info(f"{mac} recovered")
+            return
+        if now is None:
+            now = time.time()
+        failures = self._failures(mac, now)
+        failures.count += 1
+        if failures.count >= self.failure_budget:
+            failures.quarantined = True
+            failures.until = now + self.quarantine_s
+            logger.warning(
+                f"{mac} quarantined for {self.quarantine_s}s after {failures.count} failures, last: {outcome}"
+            )
+            return
+        delay = min(MAX_BACKOFF_S,
+                    BACKOFF_S.get(outcome, MAX_BACKOFF_S) * 2**(failures.count - 1))
+        #half the delay is fixed, the rest is spread so failing tags do not line up
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        failures.until = now + delay
+        logger.info(f"{mac} {outcome} failure {failures.count}, next try in {delay:.0f}s")
+
+    def _failures(self, mac: str, now: float) -> Failures:
+        failures = self.tags.get(mac)
+        if failures:
+            self.tags.move_to_end(mac)
+            return failures
+        #the oldest failures are at the front
+        while self.tags and next(iter(self.tags.values())).until + FORGET_S < now:
+            self.tags.popitem(last=False)
+        failures = self.tags[mac] = Failures()
+        if len(self.tags) > self.max_tags:
+            self.tags.popitem(last=False)
+        return failures
+
+    def quarantined(self):
+        return [mac for (mac, f) in self.tags.items() if f.quarantined]
+
+
+if __name__ == "__main__":
+    tracker = FailureTracker()
+    mac = "01000000000001"
+    now = 0.0
+    tries = 0
+    while now < 2 * 60 * 60:
+        if tracker.allowed(mac, now):
+            tries += 1
+            tracker.record(mac, CONNECT_FAILED, now)
+        now += 1
+    #a tag that never answers costs a few tries an hour instead of one per cycle
+    print(f"{tries} connects to a dead tag in 2 hours, quarantined: {tracker.quarantined()}")
+    tracker.record(mac, OK, now)
+    assert tracker.allowed(mac, now)
+
+    #tags passing by once must not grow the tracker without bound
+    tracker = FailureTracker(max_tags=100)
+    for i in range(1000):
+        tracker.record(f"{i:014X}", CONNECT_FAILED, i * 60.0)
+    assert len(tracker.tags) <= 100, len(tracker.tags)
+    tracker.record(mac, CONNECT_FAILED, 1000 * 60.0 + FORGET_S + MAX_BACKOFF_S)
+    assert list(tracker.tags) == [mac], len(tracker.tags)
+    print("failures of departed tags are forgotten")
@@ -12,6 +12,15 @@ import sb.command as bt_cmd
 import sb.response as bt_resp
 import logging
 from .smp import SmpFileResp
+from .device_state import DeviceStore, Partial, Uploaded
+from .log_file import CT_LOG_HEADER_SIZE, ENTRY_START, DataLogStream, LogCrcStream, header_fingerprint, header_times
+from .tracker_log import CtFileStream
+from .decision import download_done
+from .backoff import OK, CONNECT_FAILED, DOWNLOAD_FAILED
+from .outbox import Outbox
+from .router import LineQueue
+from publisher import Publisher, PublishDropped, DROP_NEWEST
+from .metrics import global_metrics
 import os
 import time
 import binascii
@@ -19,23 +28,106 @@ import binascii
 logger = logging.getLogger(__name__)
 
 MAX_RETRIES = 2
+CONNECT_TIMEOUT = 1.25
+DOWNLOAD_TIMEOUT = 45
+#time to wait for the next SMP notification before the outstanding requests are sent again
+RESPONSE_TIMEOUT = 1.0
+#responses waiting for this device, more than a full SMP window of notifications
+QUEUE_SIZE = 256
 
 LOG_CT = "/log/ct"
 PARAMS = "/lfs/params.txt"
 
+#payload formats whose log is parsed while it downloads
+LOG_STREAMS = {
+    "json": CtFileStream,
+    "json_legacy": DataLogStream,
+    "mg100": DataLogStream,
+    "summary": CtFileStream,
+    "json_summary": CtFileStream
+}
+
+
+def publish_log(client, payload_format: str, data: bytes, mac: str, log=None):
+    with global_metrics.timer("publish", mac):
+        _publish_log(client, payload_format, data, mac, log)
+
+
+def _publish_log(client, payload_format: str, data: bytes, mac: str, log=None):
+    if payload_format == "json":
+        client.publish_json(data, mac, log)
+    elif payload_format == "json_legacy":
+        client.publish_json_legacy(data, mac, log)
+    elif payload_format == "mg100":
+        client.publish_mg100(data, mac, log)
+    elif payload_format == "summary":
+        client.publish_summary(data, mac, log)
+    elif payload_format == "json_summary":
+        client.publish_json(data, mac, log)
+        client.publish_summary(data, mac, log)
+    else:
+        client.publish_b64(data, mac)
+
 
 class Bt510Ct():
     last_conn_mac = ""
     bin_format = False
+    smp_window = 1
+    store = DeviceStore()
+    incremental = False
+    outbox = None
+    publisher = None
 
     @classmethod
     def set_payload_format(cls, val: str):
         cls.payload_format = val
 
+    @classmethod
+    def set_smp_window(cls, val: int):
+        cls.smp_window = max(1, int(val))
+
     @classmethod
     def set_client(cls, client):
         cls.client = client
 
+    @classmethod
+    def set_store(cls, store: DeviceStore):
+        cls.store = store
+
+    @classmethod
+    def set_incremental(cls, val: bool):
+        cls.incremental = bool(val)
+
+    @classmethod
+    def set_outbox(cls, outbox: Outbox):
+        cls.outbox = outbox
+
+    @classmethod
+    def set_publisher(cls, publisher: Publisher):
+        cls.publisher = publisher
+
+    @classmethod
+    async def _send(cls, payload_format: str, data: bytes, mac: str, log=None,
+                    wait: bool = True):
+        """ hand a log to the publisher, returns the future of the publish. Without
+        wait a full queue fails the future with PublishDropped. Without a publisher it
+        is published here and None is returned """
+        if cls.publisher and not wait:
+            return cls.publisher.submit(publish_log, cls.client, payload_format,
+                                        data, mac, log, policy=DROP_NEWEST)
+        if cls.publisher:
+            return await cls.publisher.put(publish_log, cls.client,
+                                           payload_format, data, mac, log)
+        publish_log(cls.client, payload_format, data, mac, log)
+        return None
+
+    @classmethod
+    async def publish_record(cls, meta: dict, data: bytes, log=None):
+        """ publish a log replayed from the outbox """
+        done = await cls._send(meta["format"], data, meta["mac"], log)
+        if done:
+            await done
+
     def __init__(self,
                  mac: str,
                  inst: aioserial.aioserial,
@@ -43,88 +135,331 @@ class Bt510Ct():
                  binary=False):
         self.mac = mac
         self.aio_serial_inst = inst
-        self.queue = asyncio.Queue()
+        #notifications are dropped when it is full, never the connection events
+        self.queue = LineQueue(QUEUE_SIZE, ("evt_hvx:", ))
         self.conn_handle = 0
         self.started = 0
         self.conn_lock = lock
         self.binary = bin
+        self.file_data = None
+        self.smp_file = None
+        self.log_stream = None
+        self.parse_s = 0.0
+        #the link is up, until a dconnH
+        self.linked = False
+        #position and bytes of the saved download the device has to send again
+        self.overlap = None
+        #the download after a skip has to start with an entry
+        self.skip_check = False
+        #the saved download did not match the device, it is not kept
+        self.discard = False
 
     def get_queue(self):
         return self.queue
 
     async def work(self):
+        outcome = CONNECT_FAILED
         try:
-            res = await asyncio.wait_for(self._connect(), timeout=2.5)
+            with global_metrics.timer("connect", self.mac):
+                res = await self._connect()
             if res:
-                await asyncio.wait_for(self._get_file(LOG_CT), timeout=45)
-                await asyncio.wait_for(self._disconnect(), timeout=1)
-                await asyncio.wait_for(self._publish(), timeout=2)
+                outcome = DOWNLOAD_FAILED
+                try:
+                    with global_metrics.timer("download", self.mac):
+                        await asyncio.wait_for(self._get_file(LOG_CT),
+                                               timeout=DOWNLOAD_TIMEOUT)
+                finally:
+                    #always release the link, the BL654 has a limited number of connections
+                    if self.linked:
+                        await self._release()
+                if self.file_data is not None:
+                    outcome = OK
+                    global_metrics.count("bytes", len(self.file_data), self.mac)
+                done = await self._publish()
+                if done:
+                    #the link slot is not held while the publish runs
+                    done.add_done_callback(self._published)
+                else:
+                    self._uploaded()
         except asyncio.TimeoutError:
             logger.info(f'connection timeout {self.mac}')
+            global_metrics.count("timeout", mac=self.mac)
+        finally:
+            global_metrics.count(outcome, mac=self.mac)
+            download_done(self.mac, outcome)
 
-    async def _publish(self):
+    async def _publish(self) -> asyncio.Future:
+        if self.file_data and len(self.file_data) == CT_LOG_HEADER_SIZE \
+                and self.smp_file.skip_to:
+            logger.info(f"{self.mac} no new log entries")
+            return
         if self.file_data:
             logger.debug("publish")
-            if Bt510Ct.payload_format == "json":
-                Bt510Ct.client.publish_json(self.file_data, self.mac)
-            elif Bt510Ct.payload_format == "json_legacy":
-                Bt510Ct.client.publish_json_legacy(self.file_data, self.mac)
-            elif Bt510Ct.payload_format == "mg100":
-                Bt510Ct.client.publish_mg100(self.file_data, self.mac)
-            else:
-                Bt510Ct.client.publish_b64(self.file_data, self.mac)
+            log = self._parsed_log()
+            if Bt510Ct.outbox:
+                #stored first, the outbox publishes it and replays it if that fails
+                pending = Bt510Ct.outbox.append(
+                    {
+                        "format": Bt510Ct.payload_format,
+                        "mac": self.mac,
+                        "time": int(time.time())
+                    }, self.file_data, log)
+                logger.debug(f"{self.mac} log in outbox, {pending} waiting")
+                return
+            #the scan does not wait for a full publish queue, the log stays on the tag
+            return await Bt510Ct._send(Bt510Ct.payload_format, self.file_data,
+                                       self.mac, log, wait=False)
+
+    def _parsed_log(self):
+        """ the log parsed during the download, None if it has to be parsed again """
+        if not self.log_stream:
+            return None
+        start = time.monotonic()
+        log = self.log_stream.result(self.file_data)
+        #the log is parsed as it arrives, the time of that is in parse_s
+        global_metrics.observe("parse", self.parse_s + time.monotonic() - start,
+                               self.mac)
+        if not log:
+            logger.debug(f"{self.mac} log stream incomplete, parsing after download")
+        return log
 
     async def _connect(self):
         handle: str = None
         try_count: int = 0
-        async with self.conn_lock:
-            Bt510Ct.last_conn_mac = self.mac
-            connect = bt_cmd.get_conn_cmd(self.mac)
-            while not handle and try_count < MAX_RETRIES:
-                await self.aio_serial_inst.write_async(connect)
-                resp = await self.queue.get()
-                handle = bt_resp.get_handle_from_conn_resp(resp)
-                if handle:
-                    logger.debug(f"handle {self.mac} -> {repr(resp)}")
-                else:
-                    logger.debug(f"handle error -> {repr(resp)}")
-                self.queue.task_done()
-                try_count += 1
-            Bt510Ct.last_conn_mac = ""
+        connect = bt_cmd.get_conn_cmd(self.mac)
+        while not handle and try_count < MAX_RETRIES:
+            #the lock is only held for one handshake, other links keep transferring
+            async with self.conn_lock:
+                Bt510Ct.last_conn_mac = self.mac
+                try:
+                    handle = await asyncio.wait_for(
+                        self._connect_attempt(connect),
+                        timeout=CONNECT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.debug(f"{self.mac} connect attempt timeout")
+                finally:
+                    Bt510Ct.last_conn_mac = ""
+            try_count += 1
         if handle:
             self.conn_handle = int(handle, 16)
+            self.linked = True
             return handle
 
+    async def _connect_attempt(self, connect: bytes):
+        #drop anything left over from a previous attempt that timed out
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+        await self.aio_serial_inst.write_async(connect)
+        resp = await self.queue.get()
+        handle = bt_resp.get_handle_from_conn_resp(resp)
+        if handle:
+            logger.debug(f"handle {self.mac} -> {repr(resp)}")
+        else:
+            logger.debug(f"handle error -> {repr(resp)}")
+        self.queue.task_done()
+        return handle
+
+    async def _release(self):
+        """ a slow disconnect must not cost the log that was already downloaded """
+        try:
+            await asyncio.wait_for(self._disconnect(), timeout=1)
+        except asyncio.TimeoutError:
+            #linked stays set, the module has not confirmed the link is gone
+            logger.warning(f"{self.mac} disconnect timeout")
+            global_metrics.count("disconnect_timeout", mac=self.mac)
+
     async def _disconnect(self):
-        async with self.conn_lock:
-            logger.debug(f"{self.mac} disconnect")
-            await self.aio_serial_inst.write_async(
-                bt_cmd.get_disconnect_cmd(self.conn_handle))
+        logger.debug(f"{self.mac} disconnect")
+        await self.aio_serial_inst.write_async(
+            bt_cmd.get_disconnect_cmd(self.conn_handle))
+        #wait for the module to free the connection before giving up the link slot
+        while True:
+            resp = await self.queue.get()
+            self.queue.task_done()
+            if resp.startswith("dconnH"):
+                self.linked = False
+                break
+
+    def _start(self, file: SmpFileResp):
+        """ the log header has arrived - skip what was uploaded before, then resume """
+        head = file.head()
+        fingerprint = header_fingerprint(head)
+        if not fingerprint:
+            return
+        if Bt510Ct.incremental:
+            self._skip_uploaded(file, fingerprint, head)
+        self._resume(file, fingerprint)
+
+    def _skip_uploaded(self, file: SmpFileResp, fingerprint: str, head):
+        uploaded = Bt510Ct.store.load_uploaded(self.mac)
+        if not uploaded:
+            return
+        (device_time, _) = header_times(head)
+        if fingerprint != uploaded.fingerprint or uploaded.offset > file.file_len \
+                or device_time < uploaded.device_time:
+            logger.info(f"{self.mac} log changed, full download")
+            return
+        file.skip(CT_LOG_HEADER_SIZE, uploaded.offset)
+        self.skip_check = file.skip_to > file.skip_from
+
+    def _check_skip(self, file: SmpFileResp) -> bool:
+        """ False if there is no entry where the last upload ended, the log was
+        rewritten under the same fingerprint """
+        head = file.head()
+        if len(head) <= CT_LOG_HEADER_SIZE:
+            return True
+        self.skip_check = False
+        if head[CT_LOG_HEADER_SIZE] == ENTRY_START:
+            return True
+        logger.warning(f"{self.mac} no entry where the last upload ended")
+        Bt510Ct.store.clear_uploaded(self.mac)
+        self.discard = True
+        return False
+
+    def _resume(self, file: SmpFileResp, fingerprint: str):
+        """ continue an interrupted download if the log on the device is still the same.
+        The entries of the first response have to match the saved ones (the header
+        changes as entries are added), and the last saved chunk is downloaded again and
+        checked in _check_overlap """
+        partial = Bt510Ct.store.load_partial(self.mac)
+        if not partial:
+            return
+        head = file.head()
+        if fingerprint != partial.fingerprint or (partial.skip_from, partial.skip_to) != \
+                (file.skip_from, file.skip_to) or len(partial.data) > len(file.buffer) \
+                or partial.data[CT_LOG_HEADER_SIZE:len(head)] != head[CT_LOG_HEADER_SIZE:]:
+            logger.info(f"{self.mac} log changed, partial download discarded")
+            Bt510Ct.store.clear_partial(self.mac)
+            return
+        keep = max(len(head), len(partial.data) - file.chunk_size)
+        if keep < len(partial.data):
+            self.overlap = (keep, bytes(partial.data[keep:]))
+        file.resume(partial.data[:keep])
+
+    def _check_overlap(self, file: SmpFileResp) -> bool:
+        """ False if the bytes downloaded again differ from the saved ones """
+        (pos, saved) = self.overlap
+        head = file.head()
+        if len(head) < pos + len(saved):
+            return True
+        self.overlap = None
+        if head[pos:pos + len(saved)] == saved:
+            return True
+        logger.warning(f"{self.mac} resumed download does not match the device")
+        self.discard = True
+        return False
+
+    def _keep_partial(self, file: SmpFileResp):
+        if file.is_complete() or self.discard:
+            Bt510Ct.store.clear_partial(self.mac)
+            return
+        head = file.head()
+        if len(head) > CT_LOG_HEADER_SIZE:
+            logger.info(
+                f"{self.mac} download interrupted at {file.contiguous} of {file.file_len}"
+            )
+            Bt510Ct.store.save_partial(
+                self.mac,
+                Partial(header_fingerprint(head), file.skip_from,
+                        file.skip_to, head))
+
+    def _published(self, done: asyncio.Future):
+        if done.cancelled():
+            return
+        if isinstance(done.exception(), PublishDropped):
+            #not saved as uploaded, the next download has it again
+            logger.warning(f"{self.mac} log not published, the publish queue is full")
+            global_metrics.count("publish_dropped", mac=self.mac)
+        elif done.exception() is None:
+            self._uploaded()
+
+    def _uploaded(self):
+        """ remember where the published part of the log ends """
+        file = self.smp_file
+        if not self.file_data or file.contiguous < file.file_len:
+            return
+        if Bt510Ct.outbox:
+            #the offset is written at once, the record it stands for must not be lost after it
+            Bt510Ct.outbox.sync()
+        (device_time, last_upload) = header_times(self.file_data)
+        Bt510Ct.store.save_uploaded(
+            self.mac,
+            Uploaded(header_fingerprint(self.file_data), file.file_len,
+                     device_time, last_upload))
 
     async def _get_file(self, filename: str):
-        file = SmpFileResp(self.mac, filename)
+        crc_stream = LogCrcStream()
+        stream = LOG_STREAMS.get(Bt510Ct.payload_format)
+        self.log_stream = stream() if stream else None
+        self.parse_s = 0.0
+
+        def on_data(data):
+            start = time.monotonic()
+            try:
+                crc_stream.feed(data)
+                if self.log_stream:
+                    self.log_stream.feed(data)
+            except Exception as e:
+                #only the streaming stops, the log is parsed once it is complete
+                logger.warning(f"{self.mac} log stream error {e}")
+                crc_stream.broken = True
+                if self.log_stream:
+                    self.log_stream.broken = True
+            self.parse_s += time.monotonic() - start
+
+        file = SmpFileResp(self.mac,
+                           filename,
+                           Bt510Ct.smp_window,
+                           on_start=self._start,
+                           on_data=on_data)
+        self.smp_file = file
+        try:
+            await self._transfer(file)
+        finally:
+            self._keep_partial(file)
+        if crc_stream.errors:
+            logger.warning(
+                f"{self.mac} {len(crc_stream.errors)} of {crc_stream.count} log records failed CRC"
+            )
+
+    async def _transfer(self, file: SmpFileResp):
         temp = file.get_file_cmd(self.conn_handle)
         logger.debug(f"{self.mac} write {temp}")
         await self.aio_serial_inst.write_async(temp)
 
-        while True:
-            resp = await self.queue.get()
+        while not file.is_complete():
+            try:
+                resp = await asyncio.wait_for(self.queue.get(),
+                                              timeout=RESPONSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                file.lost()
+                await self._write_cmds(file.get_cmds(self.conn_handle))
+                continue
+            self.queue.task_done()
             ##todo remove sb specific portion
             if "evt_hvx:" in resp:
                 (_, _, data) = bt_resp.sb_notif_decode(resp)
-                #if file.data returns true, response. Else, wait for more data
-                if file.data(data):
-                    if file.is_complete():
-                        self.file_data = file.read()
-                        logger.debug('file data: {}'.format(self.file_data.hex()))
-                        break
-                    else:
-                        temp = file.get_cmd(self.conn_handle)
-                        async with self.conn_lock:
-                            logger.debug(f"{self.mac} write ${temp}")
-                            await self.aio_serial_inst.write_async(temp)
+                #if file.data returns true, a response is complete. Else, wait for more data
+                if file.data(data) and not file.is_complete():
+                    await self._write_cmds(file.get_cmds(self.conn_handle))
+                if self.overlap and not self._check_overlap(file):
+                    #the next download starts over
+                    break
+                if self.skip_check and not self._check_skip(file):
+                    #the next download is a full one
+                    break
             else:
+                if resp.startswith("dconnH"):
+                    self.linked = False
                 logger.error(repr(resp))
                 break
 
-            self.queue.task_done()
+        if file.is_complete() and not self.discard:
+            self.file_data = file.read()
+            logger.debug('file data: {}'.format(self.file_data.hex()))
+
+    async def _write_cmds(self, cmds):
+        for temp in cmds:
+            logger.debug(f"{self.mac} write ${temp}")
+            await self.aio_serial_inst.write_async(temp)
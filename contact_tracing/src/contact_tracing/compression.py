@@ -0,0 +1,141 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Optional compression of the published payloads. A compressed message is the envelope
+#   {"content_encoding": "deflate", "payload": "<base64>", "dictionary": "<adler32>"}
+# payload holds what the uncompressed message would have sent: the JSON document, or
+# the log itself for b64. dictionary is only there when a preset dictionary was used,
+# it is the zlib dictionary id, the adler32 of the dictionary.
+import json
+import zlib
+import base64
+import logging
+from .log_file import HEADER_JSON, ENTRY_JSON
+from .tracker_log import CT_FILE_JSON, CT_ENTRY_JSON
+
+logger = logging.getLogger(__name__)
+
+#the zlib format (RFC 1950), which is HTTP deflate, and gzip (RFC 1952)
+ENCODINGS = {"deflate": zlib.MAX_WBITS, "gzip": 16 + zlib.MAX_WBITS}
+DEFAULT_LEVEL = 6
+#"dictionary": "templates" presets the keys of the JSON documents
+TEMPLATES = "templates"
+
+
+def template_dictionary() -> bytes:
+    """ the JSON templates, the most common strings last as zlib prefers those """
+    return "".join([
+        HEADER_JSON, ENTRY_JSON, CT_FILE_JSON, CT_ENTRY_JSON,
+        '{"recordType": 17, "delta": 0, "rssi": -70, "motion": 0, "txPower": 0}, ',
+        '{"rssi": -70, "motion": 0, "tx_power": 0, "record_type": 17, "delta": 0}, '
+    ]).encode()
+
+
+class PayloadCompressor():
+    def __init__(self,
+                 encoding: str = "deflate",
+                 level: int = DEFAULT_LEVEL,
+                 dictionary: bytes = None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"unknown content encoding {encoding}")
+        if dictionary and encoding != "deflate":
+            raise ValueError("a preset dictionary needs deflate")
+        self.encoding = encoding
+        self.level = level
+        self.wbits = ENCODINGS[encoding]
+        self.dictionary = dictionary
+        self.dictionary_id = f"{zlib.adler32(dictionary):08x}" if dictionary else None
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def compress(self, data: bytes) -> bytes:
+        if self.dictionary:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits,
+                                 zdict=self.dictionary)
+        else:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+        out = c.compress(data) + c.flush()
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(out)
+        return out
+
+    def envelope(self, data: bytes) -> str:
+        """ the message for data """
+        env = {
+            "content_encoding": self.encoding,
+            "payload": str(base64.b64encode(self.compress(data)), "ascii")
+        }
+        if self.dictionary_id:
+            env["dictionary"] = self.dictionary_id
+        return json.dumps(env)
+
+    def ratio(self) -> float:
+        return self.compressed_bytes / self.raw_bytes if self.raw_bytes else 1.0
+
+
+def decompress(env: dict, dictionary: bytes = None) -> bytes:
+    """ the payload of an envelope, what a receiver does """
+    data = base64.b64decode(env["payload"])
+    if env.get("dictionary"):
+        d = zlib.decompressobj(ENCODINGS[env["content_encoding"]], zdict=dictionary)
+    else:
+        d = zlib.decompressobj(ENCODINGS[env["content_encoding"]])
+    return d.decompress(data) + d.flush()
+
+
+def compressor_from_options(options: dict) -> PayloadCompressor:
+    """ the payload_options of ct_app.json, None when payloads are not compressed """
+    options = options or {}
+    encoding = options.get("compression")
+    if not encoding:
+        return None
+    dictionary = options.get("dictionary")
+    if dictionary == TEMPLATES:
+        dictionary = template_dictionary()
+    elif dictionary:
+        with open(dictionary, 'rb') as fp:
+            dictionary = fp.read()
+    compressor = PayloadCompressor(encoding,
+                                   options.get("level", DEFAULT_LEVEL),
+                                   dictionary)
+    logger.info(f"payloads compressed with {encoding} level {compressor.level}"
+                f" dictionary {compressor.dictionary_id}")
+    return compressor
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+    from .tracker_log import logs_json
+
+    #a CtFile document of a busy tag
+    rand = random.Random(1)
+    entries = ", ".join(
+        CT_ENTRY_JSON % (i * 16, 0, 10, 1600000000 + i * 60, 200,
+                         "%012X" % rand.randrange(1 << 48),
+                         logs_json((17, 0, 0, j, rand.randint(-90, -40),
+                                    rand.randrange(2), 0) for j in range(20)))
+        for i in range(500))
+    doc = (CT_FILE_JSON % (1, 1600000000, 1599990000, 0xFFFF, "C0FFEE000001",
+                           "5.0.0", 3000, entries)).encode()
+    small = doc[:doc.index(b', {"entryStart": 32')] + b"]}"
+
+    for (name, compressor) in [
+            ("deflate 1", PayloadCompressor("deflate", 1)),
+            ("deflate 6", PayloadCompressor("deflate", 6)),
+            ("deflate 9", PayloadCompressor("deflate", 9)),
+            ("gzip 6", PayloadCompressor("gzip", 6)),
+            ("deflate 6 dict", PayloadCompressor("deflate", 6, template_dictionary()))]:
+        for payload in (doc, small):
+            env = json.loads(compressor.envelope(payload))
+            assert decompress(env, compressor.dictionary) == payload
+        secs = timeit.timeit(lambda: compressor.compress(doc), number=5) / 5
+        sizes = [len(compressor.envelope(p)) for p in (doc, small)]
+        print(f"{name:15} {len(doc)} -> {sizes[0]} bytes {secs * 1000:.1f} ms,"
+              f" small {len(small)} -> {sizes[1]}")
@@ -0,0 +1,114 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# CRC-16/Kermit (poly 0x1021 reflected, init 0, no final xor)
+#
+# Kermit is the bit reflected form of the CCITT CRC that binascii.crc_hqx computes
+# with a table in C. Reflecting every input byte with a precomputed translate table,
+# running crc_hqx, and reflecting the 16 bit result gives the Kermit value.
+import binascii
+
+REFLECT = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def _reflect16(value: int) -> int:
+    return (REFLECT[value & 0xFF] << 8) | REFLECT[value >> 8]
+
+
+def reflect(data) -> bytes:
+    """ reflect the bits of every byte """
+    if isinstance(data, (bytes, bytearray)):
+        return data.translate(REFLECT)
+    return bytes(data).translate(REFLECT)
+
+
+def crc16_kermit(data) -> int:
+    return _reflect16(binascii.crc_hqx(reflect(data), 0))
+
+
+class Crc16Kermit():
+    """ incremental CRC, data can be given in pieces of any size """
+    def __init__(self, data=b""):
+        self._state = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        self._state = binascii.crc_hqx(reflect(data), self._state)
+
+    def reset(self):
+        self._state = 0
+
+    @property
+    def crcValue(self) -> int:
+        return _reflect16(self._state)
+
+
+class ReflectedData():
+    """ a buffer reflected once, so the CRC of any range is computed without a copy """
+    def __init__(self, data):
+        self.view = memoryview(reflect(data))
+
+    def crc(self, start: int, end: int) -> int:
+        return _reflect16(binascii.crc_hqx(self.view[start:end], 0))
+
+
+if __name__ == "__main__":
+    import os
+    import struct
+    import timeit
+    from .log_file import DataLog, LogCrcStream
+
+    assert crc16_kermit(b"123456789") == 0x2189
+
+    def entry(i: int) -> bytes:
+        records = b"".join(
+            struct.pack("<BBBHbBB", 17, 0, 0, j, -60, 0, 0) for j in range(12))
+        header = struct.pack("<BBH6sIH", 0xA5, 0, 10, os.urandom(6), i,
+                             16 + len(records))
+        data = header + records
+        return data + struct.pack("<H", crc16_kermit(data))
+
+    header = os.urandom(47)
+    log = header + struct.pack("<H", crc16_kermit(header))
+    log += b"".join(entry(i) for i in range(5000))
+    offsets = []
+    off = 49
+    while off < len(log):
+        length = struct.unpack_from("<H", log, off + 14)[0]
+        offsets.append((off, length))
+        off += length + 2
+
+    def per_entry_crcmod():
+        import crcmod.predefined
+        for (off, length) in offsets:
+            cr = crcmod.predefined.Crc("kermit")
+            cr.update(log[off:off + length])
+
+    def per_entry_reflected():
+        data = ReflectedData(log)
+        for (off, length) in offsets:
+            data.crc(off, off + length)
+
+    def streaming():
+        stream = LogCrcStream()
+        view = memoryview(log)
+        for i in range(0, len(log), 240):
+            stream.feed(view[i:i + 240])
+        assert not stream.errors
+
+    runs = 3
+    print(f"log of {len(offsets)} entries, {len(log)} bytes")
+    try:
+        print(f"crcmod per entry:     {timeit.timeit(per_entry_crcmod, number=runs) / runs * 1000:.1f} ms")
+    except ImportError:
+        print("crcmod not installed")
+    print(f"reflected per entry:  {timeit.timeit(per_entry_reflected, number=runs) / runs * 1000:.1f} ms")
+    print(f"streaming 240B chunks: {timeit.timeit(streaming, number=runs) / runs * 1000:.1f} ms")
+    print(f"DataLog:              {timeit.timeit(lambda: DataLog(log), number=runs) / runs * 1000:.1f} ms")
@@ -10,10 +10,15 @@ import logging
 from typing import List
 import sb.adv as bt_adv
 from .adv_time import adv_time, local_time
+from .scheduler import Scheduler, STARVATION_S
+from .backoff import FailureTracker, FAILURE_BUDGET, OK, QUARANTINE_S
 logger = logging.getLogger(__name__)
 
 global_target_list = []
+global_max_con = 1
 RSSI_THRESHOLD = -80
+global_scheduler = Scheduler(RSSI_THRESHOLD)
+global_failures = FailureTracker()
 
 
 def establish_targets(targetl: List[str]):
@@ -21,32 +26,66 @@ def establish_targets(targetl: List[str]):
     global_target_list = targetl
 
 
+def establish_max_con(max_con: int):
+    #number of devices selected per cycle, and the number of links downloading at once
+    global global_max_con
+    global_max_con = max(1, int(max_con))
+
+
+def get_max_con() -> int:
+    return global_max_con
+
+
+def establish_scheduler(starvation_s: float = None):
+    #a tag that waited longer than starvation_s since its last download goes first
+    global global_scheduler
+    global_scheduler = Scheduler(RSSI_THRESHOLD, starvation_s or STARVATION_S)
+
+
+def establish_backoff(failure_budget: int = None, quarantine_s: float = None):
+    #failures in a row before a tag is quarantined, and for how long
+    global global_failures
+    global_failures = FailureTracker(failure_budget or FAILURE_BUDGET,
+                                     quarantine_s or QUARANTINE_S)
+
+
+def download_done(mac: str, outcome: str):
+    #outcome of a connection (see backoff.py), used to schedule the next ones
+    if outcome == OK:
+        global_scheduler.success(mac)
+    else:
+        global_scheduler.failure(mac)
+    global_failures.record(mac, outcome)
+
+
 def add_target(target: bt_adv.ScanRes) -> bool:
     #checks basic criteria for added a device to connection list. Check RSSI is strong enough. Check that target is on the list
     global global_target_list
 
     if target.rssi < RSSI_THRESHOLD:
         return False
+    if not global_failures.allowed(target.mac):
+        return False
     if global_target_list == []:
         return target.data_available
     else:
         return target.mac in global_target_list and target.data_available
 
 
-async def decision(*targets: bt_adv.ScanRes, max_con: int = 1):
+async def decision(*targets: bt_adv.ScanRes, max_con: int = None):
     #takes in scan results, and makes a decision on which targets to connect to
     global global_target_list
-    targetl = []
+    if max_con is None:
+        max_con = global_max_con
+    qualified = []
     for target in targets:
         try:
             logger.debug(
                 f"{target.mac} rssi:{target.rssi} time:{local_time(target.epoch)} has_data:{target.data_available} has_epoch:{target.has_epoch}"
             )
             if add_target(target):
-                if target.mac not in targetl:
-                    targetl.append(target.mac)
-                if len(targetl) >= max_con:
-                    break
+                qualified.append(target)
         except Exception as e:
             logger.error(f'decision exception ->  {e} - {repr(target)}  ')
-    return targetl
+    #the best max_con of the qualifying targets, see scheduler.py
+    return global_scheduler.select(qualified, max_con)
@@ -0,0 +1,117 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+import os
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+#data is the download buffer, the file with bytes skip_from to skip_to left out
+Partial = namedtuple('Partial', ['fingerprint', 'skip_from', 'skip_to', 'data'])
+#offset is the end of the last entry that was published
+Uploaded = namedtuple('Uploaded',
+                      ['fingerprint', 'offset', 'device_time', 'last_upload'])
+
+
+class DeviceStore():
+    """ per device download state, kept in a directory so it survives a restart
+
+    Without a directory the state is only kept in memory. """
+    def __init__(self, path: str = None):
+        self.path = path
+        self.partials = {}
+        self.uploads = {}
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, mac: str, ext: str) -> str:
+        return os.path.join(self.path, f"{mac}.{ext}")
+
+    def _write(self, name: str, data: bytes):
+        temp = name + ".tmp"
+        with open(temp, 'wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp, name)
+
+    def _read_json(self, mac: str, ext: str) -> dict:
+        try:
+            with open(self._file(mac, ext), 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self, mac: str, ext: str):
+        try:
+            os.remove(self._file(mac, ext))
+        except FileNotFoundError:
+            pass
+
+    def save_partial(self, mac: str, partial: Partial):
+        """ keep the bytes received so far """
+        if not self.path:
+            self.partials[mac] = partial._replace(data=bytes(partial.data))
+            return
+        try:
+            self._write(self._file(mac, "part"), partial.data)
+            meta = partial._asdict()
+            meta["data"] = len(partial.data)
+            self._write(self._file(mac, "json"), json.dumps(meta).encode())
+        except OSError as e:
+            logger.error(f"{mac} could not save partial download {e}")
+
+    def load_partial(self, mac: str) -> Partial:
+        if not self.path:
+            return self.partials.get(mac)
+        meta = self._read_json(mac, "json")
+        if not meta:
+            return None
+        try:
+            with open(self._file(mac, "part"), 'rb') as fp:
+                data = fp.read()
+        except OSError:
+            return None
+        if len(data) != meta["data"]:
+            logger.warning(f"{mac} partial download does not match its index")
+            return None
+        meta["data"] = data
+        return Partial(**meta)
+
+    def clear_partial(self, mac: str):
+        if not self.path:
+            self.partials.pop(mac, None)
+            return
+        self._remove(mac, "json")
+        self._remove(mac, "part")
+
+    def save_uploaded(self, mac: str, uploaded: Uploaded):
+        if not self.path:
+            self.uploads[mac] = uploaded
+            return
+        try:
+            self._write(self._file(mac, "uploaded"),
+                        json.dumps(uploaded._asdict()).encode())
+        except OSError as e:
+            logger.error(f"{mac} could not save upload state {e}")
+
+    def load_uploaded(self, mac: str) -> Uploaded:
+        if not self.path:
+            return self.uploads.get(mac)
+        meta = self._read_json(mac, "uploaded")
+        if not meta:
+            return None
+        return Uploaded(**meta)
+
+    def clear_uploaded(self, mac: str):
+        if not self.path:
+            self.uploads.pop(mac, None)
+            return
+        self._remove(mac, "uploaded")
@@ -0,0 +1,115 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Exposure summaries, published instead of or with the records of a log. Each record
+# is one RSSI sample of a remote device, delta scan intervals after the timestamp of
+# its entry, and stands for one scan interval of exposure.
+import json
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from .tracker_log import CtFile
+
+logger = logging.getLogger(__name__)
+
+PATH_LOSS = "path_loss"
+RSSI = "rssi"
+#path loss in dB (txPower - rssi), or for the rssi metric dBm, nearest band first
+DEFAULT_BANDS = {PATH_LOSS: [55, 63, 70], RSSI: [-55, -65, -75]}
+#samples further apart than this many scan intervals start a new exposure interval
+GAP_INTERVALS = 2
+
+
+class ExposureSummarizer():
+    """ for each remote device: first and last seen, the nearest sample, the seconds
+    spent in each band and the intervals it was seen in. bandSeconds has one more
+    element than bands, the time beyond the last one """
+    def __init__(self,
+                 metric: str = PATH_LOSS,
+                 bands: list = None,
+                 gap_intervals: int = GAP_INTERVALS):
+        if metric not in DEFAULT_BANDS:
+            raise ValueError(f"unknown exposure metric {metric}")
+        self.metric = metric
+        self.bands = list(bands or DEFAULT_BANDS[metric])
+        #both metrics as a loss, larger is further away
+        if metric == RSSI:
+            self.limits = sorted(-b for b in self.bands)
+        else:
+            self.limits = sorted(self.bands)
+        self.gap_intervals = gap_intervals
+
+    def _loss(self, rssi: int, tx_power: int) -> int:
+        if self.metric == RSSI:
+            return -rssi
+        return tx_power - rssi
+
+    def summarize(self, ct_file: CtFile) -> dict:
+        samples = defaultdict(list)
+        for e in ct_file.entries:
+            interval = e.scanInterval or 1
+            rows = samples[e.serial]
+            for (_, _, _, delta, rssi, _, tx_power) in e.logs.rows:
+                rows.append((e.timestamp + delta * interval, interval, rssi,
+                             tx_power))
+        return {
+            "deviceId": ct_file.deviceId,
+            "deviceTime": ct_file.deviceTime,
+            "lastUploadTime": ct_file.lastUploadTime,
+            "metric": self.metric,
+            "bands": self.bands,
+            "contacts": [
+                self._contact(serial, sorted(rows))
+                for (serial, rows) in samples.items() if rows
+            ]
+        }
+
+    def _contact(self, serial: str, rows: list) -> dict:
+        band_seconds = [0] * (len(self.limits) + 1)
+        intervals = []
+        (start, end) = (None, None)
+        peak_rssi = -128
+        min_loss = None
+        for (time, interval, rssi, tx_power) in rows:
+            loss = self._loss(rssi, tx_power)
+            band_seconds[bisect_right(self.limits, loss)] += interval
+            if rssi > peak_rssi:
+                peak_rssi = rssi
+            if min_loss is None or loss < min_loss:
+                min_loss = loss
+            if start is None or time - end > self.gap_intervals * interval:
+                if start is not None:
+                    intervals.append([start, end])
+                (start, end) = (time, time + interval)
+            else:
+                end = max(end, time + interval)
+        intervals.append([start, end])
+        contact = {
+            "serial": serial,
+            "firstSeen": rows[0][0],
+            "lastSeen": rows[-1][0],
+            "samples": len(rows),
+            "peakRssi": peak_rssi,
+            "bandSeconds": band_seconds,
+            "intervals": intervals
+        }
+        if self.metric == PATH_LOSS:
+            contact["minPathLoss"] = min_loss
+        return contact
+
+    def serialize(self, ct_file: CtFile) -> str:
+        return json.dumps(self.summarize(ct_file))
+
+
+def summarizer_from_options(options: dict) -> ExposureSummarizer:
+    """ the summary section of ct_app.json """
+    options = options or {}
+    return ExposureSummarizer(options.get("metric", PATH_LOSS),
+                              options.get("bands"),
+                              options.get("gap_intervals", GAP_INTERVALS))
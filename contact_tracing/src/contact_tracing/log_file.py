@@ -7,12 +7,13 @@
 # for the specific language governing permissions and limitations
 # under the License.
 import binascii
-import crcmod.predefined
 import json
 import struct
 import timeit
 import time
 import logging
+from typing import Dict, List, Tuple
+from .crc import Crc16Kermit, ReflectedData, crc16_kermit
 logger = logging.getLogger(__name__)
 
 
@@ -21,33 +22,24 @@ def str_end_rev(input: str) -> str:
     return "".join([b + a for a, b in zip(input[::2], input[1::2])])[::-1]
 
 
+HEADER_P1 = struct.Struct('<HHH6sIII')
+HEADER_P2 = struct.Struct('<4sHHHHHBBBbbI')
+ENTRY_HEADER = struct.Struct('<BBH6sIH')
+
+
 class LogCtHeaderP1():
     def __init__(self, data: bytes):
         if len(data) != 24:
             raise ValueError(" P1 Log header should be 24 bytes")
-        self.entry_protocol_version = int.from_bytes(data[0:2],
-                                                     byteorder="little",
-                                                     signed=False)
-        self.entry_size = int.from_bytes(data[2:4],
-                                         byteorder="little",
-                                         signed=False)
-        self.entry_count = int.from_bytes(data[4:6],
-                                          byteorder="little",
-                                          signed=False)
-
-        self.device_id = str_end_rev(str(data[6:12].hex()))
-
-        self.device_time = int.from_bytes(data[12:16],
-                                          byteorder="little",
-                                          signed=False)
-
-        self.log_size = int.from_bytes(data[16:20],
-                                       byteorder="little",
-                                       signed=False)
-
-        self.last_upload = int.from_bytes(data[20:24],
-                                          byteorder="little",
-                                          signed=False)
+        (version, entry_size, entry_count, device_id, device_time, log_size,
+         last_upload) = HEADER_P1.unpack(data)
+        self.entry_protocol_version = version
+        self.entry_size = entry_size
+        self.entry_count = entry_count
+        self.device_id = device_id[::-1].hex()
+        self.device_time = device_time
+        self.log_size = log_size
+        self.last_upload = last_upload
 
     def __repr__(self) -> str:
         return f"""Log Header 1 ->
@@ -62,48 +54,12 @@ class LogCtHeaderP1():
 
 class LogCtHeaderP2():
     def __init__(self, data: bytes):
-        self.fw_version = str(data[0:4].hex())
-        self.devices_seen = int.from_bytes(data[4:6],
-                                           byteorder="little",
-                                           signed=False)
-
-        self.network_id = int.from_bytes(data[6:8],
-                                         byteorder="little",
-                                         signed=False)
-
-        self.ad_interval_ms = int.from_bytes(data[8:10],
-                                             byteorder="little",
-                                             signed=False)
-
-        self.log_interval_min = int.from_bytes(data[10:12],
-                                               byteorder="little",
-                                               signed=False)
-
-        self.scan_interval_sec = int.from_bytes(data[12:14],
-                                                byteorder="little",
-                                                signed=False)
-
-        self.battery_level = int.from_bytes(data[14:15],
-                                            byteorder="little",
-                                            signed=False)
-
-        self.scan_dur_sec = int.from_bytes(data[15:16],
-                                           byteorder="little",
-                                           signed=False)
-        self.profile = int.from_bytes(data[16:17],
-                                      byteorder="little",
-                                      signed=False)
-        self.rssi_threshold = int.from_bytes(data[17:18],
-                                             byteorder="little",
-                                             signed=True)
-        self.tx_power = int.from_bytes(data[18:19],
-                                       byteorder="little",
-                                       signed=True)
-
-        self.up_time_sec = int.from_bytes(data[19:23],
-                                          byteorder="little",
-                                          signed=False)
-
+        (fw_version, *fields) = HEADER_P2.unpack_from(data)
+        self.fw_version = fw_version.hex()
+        (self.devices_seen, self.network_id, self.ad_interval_ms,
+         self.log_interval_min, self.scan_interval_sec, self.battery_level,
+         self.scan_dur_sec, self.profile, self.rssi_threshold, self.tx_power,
+         self.up_time_sec) = fields
         self.crc = str(data[23:25].hex())
 
     def __repr__(self) -> str:
@@ -125,9 +81,7 @@ class LogCtHeaderP2():
 
 
 def verify_crc(reported: int, data: bytes) -> bool:
-    cr = crcmod.predefined.Crc("kermit")
-    cr.update(data)
-    return reported == cr.crcValue
+    return reported == crc16_kermit(data)
 
 
 class CtLogHeader():
@@ -172,19 +126,13 @@ class EntryHeader():
                 f"For EntryHeader expected 0xA5, recieved {hex(data[0])}  @ index {hex(file_index)}"
             )
 
-        self.flags = int.from_bytes(data[1:2],
-                                    byteorder="little",
-                                    signed=False)
-        self.scan_interval = int.from_bytes(data[2:4],
-                                            byteorder="little",
-                                            signed=False)
-        self.remote_device = str_end_rev(str(data[4:10].hex()))
-        self.timestamp = int.from_bytes(data[10:14],
-                                        byteorder="little",
-                                        signed=False)
-        self.length = int.from_bytes(data[14:16],
-                                     byteorder="little",
-                                     signed=False)
+        (_, flags, scan_interval, remote_device, timestamp,
+         length) = ENTRY_HEADER.unpack(data)
+        self.flags = flags
+        self.scan_interval = scan_interval
+        self.remote_device = remote_device[::-1].hex()
+        self.timestamp = timestamp
+        self.length = length
 
     def serialize(self, indent=None) -> str:
         return json.dumps(self.__dict__,
@@ -199,21 +147,39 @@ class EntryHeader():
         timestamp : {self.timestamp}"""
 
 
+RECORD_FORMAT = struct.Struct("<BBBHbBB")
+RECORD_FIELDS = ("type", "status", "r1", "scanIntOff", "rssi", "motion",
+                 "txPower")
+
+
 class RssiTracking():
-    """ base class for Record data using struct """
+    """ base class for Record data using struct. Entries keep their records as rows,
+    this is a view of one row for when an object is needed """
+    __slots__ = RECORD_FIELDS
+
     def __init__(self, data: bytes):
         if len(data) != 8:
             raise ValueError(
-                f"RssiTracking class initilized with 8 bytes, not {len(data)}")
+                f"RssiTracking needs a record of 8 bytes, not {len(data)}")
         if data[0] != 17:
             raise ValueError(f"RssiTracking type = 0x11, not {data[0]}")
+        self._set(RECORD_FORMAT.unpack(data))
+
+    @classmethod
+    def from_row(cls, row: tuple):
+        record = cls.__new__(cls)
+        record._set(row)
+        return record
+
+    def _set(self, row: tuple):
         (self.type, self.status, self.r1, self.scanIntOff, self.rssi,
-         self.motion, self.txPower) = struct.unpack("<BBBHbBB", data)
+         self.motion, self.txPower) = row
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in RECORD_FIELDS}
 
     def serialize(self, indent=None) -> str:
-        return json.dumps(self.__dict__,
-                          default=lambda o: o.__dict__,
-                          indent=indent)
+        return json.dumps(self.as_dict(), indent=indent)
 
     def __repr__(self) -> str:
         return self.serialize(indent=2)
@@ -224,7 +190,7 @@ class RssiTracking2():
     def __init__(self, data: bytes):
         if len(data) != 8:
             raise ValueError(
-                f"RssiTracking class initilized with 8 bytes, not {len(data)}")
+                f"RssiTracking2 needs a record of 8 bytes, not {len(data)}")
         if data[0] != 17:
             raise ValueError(f"RssiTracking type = 0x11, not {data[0]}")
 
@@ -250,39 +216,68 @@ class RssiTracking2():
 
 CT_LOG_HEADER_SIZE = 49
 ENTRY_HEADER_SIZE = 16
+#first byte of every entry
+ENTRY_START = 0xA5
 CT_RECORD_TYPE = 17
 CT_RECORD_SIZE = 8
 
 
 class Entry():
-    def __init__(self, data: bytes, global_index: int):
+    """ one log entry. The records are decoded in a single pass into rows of
+    RECORD_FIELDS, see columns() and records for other views of them.
+
+    crc is the whole file reflected once, the entry starts at global_index in it """
+    def __init__(self,
+                 data: bytes,
+                 global_index: int,
+                 crc: ReflectedData = None):
         if len(data) < ENTRY_HEADER_SIZE:
             raise ValueError(
                 f"entry data size errror @{global_index}: data entry must be greater than entry header size"
             )
         self.entry_header = EntryHeader(data[:ENTRY_HEADER_SIZE], global_index)
-        self.records = []
+        self.rows = []
         entry_size = self.entry_header.length
-        i = ENTRY_HEADER_SIZE
-        global_index += ENTRY_HEADER_SIZE
         #Verify CRC
         reported_crc = int.from_bytes(data[entry_size:entry_size + 2],
                                       byteorder="little",
                                       signed=False)
-        if not verify_crc(reported_crc, data[:entry_size]):
+        if crc:
+            crc_ok = reported_crc == crc.crc(global_index,
+                                             global_index + entry_size)
+        else:
+            crc_ok = verify_crc(reported_crc, data[:entry_size])
+        self.crc_ok = crc_ok
+        if not crc_ok:
             print(f"crc error {reported_crc} ")
             self._ret_offset = entry_size + 2
             return
 
+        count = max(0, -(-(entry_size - ENTRY_HEADER_SIZE) // CT_RECORD_SIZE))
+        end = ENTRY_HEADER_SIZE + count * CT_RECORD_SIZE
+        region = data[ENTRY_HEADER_SIZE:end]
+        if len(region) % CT_RECORD_SIZE:
+            raise ValueError(
+                f"entry region not a multiple of {CT_RECORD_SIZE} bytes: {len(region)}"
+            )
+        rows = list(RECORD_FORMAT.iter_unpack(region))
         #TODO need to handle more than jsut type 17
-        while i < entry_size:
-            if data[i] != CT_RECORD_TYPE:
-                logger.error(f"unknown record type {data[i]}")
-            else:
-                self.records.append(RssiTracking(data[i:i + CT_RECORD_SIZE]))
-            i += CT_RECORD_SIZE
-            global_index += CT_RECORD_SIZE
-        self._ret_offset = i + 2
+        self.rows = [row for row in rows if row[0] == CT_RECORD_TYPE]
+        if len(self.rows) != len(rows):
+            for row in rows:
+                if row[0] != CT_RECORD_TYPE:
+                    logger.error(f"unknown record type {row[0]}")
+        self._ret_offset = end + 2
+
+    @property
+    def records(self) -> List[RssiTracking]:
+        return [RssiTracking.from_row(row) for row in self.rows]
+
+    def columns(self) -> Dict[str, tuple]:
+        """ the records as one tuple per field """
+        if not self.rows:
+            return {k: () for k in RECORD_FIELDS}
+        return dict(zip(RECORD_FIELDS, zip(*self.rows)))
 
     def get_offset(self):
         return self._ret_offset
@@ -291,7 +286,7 @@ class Entry():
         return json.dumps(
             {
                 "enytr_header": self.entry_header,
-                "records": self.records
+                "records": [dict(zip(RECORD_FIELDS, row)) for row in self.rows]
             },
             default=lambda o: o.__dict__,
             indent=indent)
@@ -300,6 +295,176 @@ class Entry():
 CT_LOG_HEADER_SIZE = 49
 
 
+def header_fingerprint(data: bytes) -> str:
+    """ header fields that identify one log on a device. They stay the same while
+    entries are appended, device time, counts and sizes are left out """
+    if len(data) < CT_LOG_HEADER_SIZE:
+        return None
+    return (bytes(data[0:4]) + bytes(data[6:12]) + bytes(data[20:28])).hex()
+
+
+def header_times(data: bytes) -> Tuple[int, int]:
+    """ device_time and last_upload from a CT log header """
+    (device_time, _log_size, last_upload) = struct.unpack_from('<III', data, 12)
+    return device_time, last_upload
+
+
+class LogCrcStream():
+    """ check the header and entry CRCs while the log arrives
+
+    The log is fed in file order, in pieces of any size. Each CRC is updated as its
+    bytes arrive, nothing but the 16 byte entry header is kept. """
+    def __init__(self):
+        self.crc = Crc16Kermit()
+        self.offset = 0
+        self.record = 0
+        self.need = CT_LOG_HEADER_SIZE - 2
+        self.length_known = True
+        self.entry_head = bytearray()
+        self.trailer = bytearray()
+        self.errors = []
+        self.count = 0
+        self.broken = False
+
+    def feed(self, data):
+        view = memoryview(data)
+        i = 0
+        while i < len(view) and not self.broken:
+            if self.need:
+                take = min(self.need, len(view) - i)
+                piece = view[i:i + take]
+                self.crc.update(piece)
+                if not self.length_known:
+                    self._entry_head(piece)
+                self.need -= take
+                if not self.need and not self.length_known:
+                    self._entry_length()
+            else:
+                take = min(2 - len(self.trailer), len(view) - i)
+                self.trailer += view[i:i + take]
+                if len(self.trailer) == 2:
+                    self._record_done(self.offset + take)
+            i += take
+            self.offset += take
+
+    def _entry_head(self, piece):
+        self.entry_head += piece[:ENTRY_HEADER_SIZE - len(self.entry_head)]
+
+    def _entry_length(self):
+        self.length_known = True
+        length = int.from_bytes(self.entry_head[14:16], byteorder="little")
+        if self.entry_head[0] != 165 or length < ENTRY_HEADER_SIZE:
+            logger.error(f"log stream lost entry framing @ {hex(self.record)}")
+            self.broken = True
+            return
+        self.need = length - ENTRY_HEADER_SIZE
+
+    def _record_done(self, end: int):
+        reported = int.from_bytes(self.trailer, byteorder="little")
+        ok = reported == self.crc.crcValue
+        if not ok:
+            self.errors.append(self.record)
+        self.count += 1
+        self.record = end
+        self.crc.reset()
+        self.trailer = bytearray()
+        self.entry_head = bytearray()
+        self.need = ENTRY_HEADER_SIZE
+        self.length_known = False
+
+    def at_boundary(self) -> bool:
+        """ true when everything fed so far ends on a record boundary """
+        return self.offset == self.record and self.count > 0
+
+
+class LogStream():
+    """ split a CT log into its header and entries while it arrives
+
+    The log is fed in file order, in pieces of any size. _header() is called once the
+    49 byte header is in, _entry() for each entry once its length and CRC are in. Both
+    get a view that is only valid during the call. Only the bytes of an entry that is
+    not complete yet are kept. """
+    def __init__(self):
+        self.pending = bytearray()
+        self.offset = 0
+        self.header_done = False
+        self.broken = False
+
+    def feed(self, data):
+        if self.broken:
+            return
+        self.pending += data
+        with memoryview(self.pending) as view:
+            pos = self._split(view)
+        del self.pending[:pos]
+        self.offset += pos
+
+    def _split(self, view: memoryview) -> int:
+        pos = 0
+        if not self.header_done:
+            if len(view) < CT_LOG_HEADER_SIZE:
+                return 0
+            self._header(view[:CT_LOG_HEADER_SIZE])
+            self.header_done = True
+            pos = CT_LOG_HEADER_SIZE
+        while not self.broken and len(view) - pos >= ENTRY_HEADER_SIZE:
+            length = int.from_bytes(view[pos + 14:pos + 16], byteorder="little")
+            end = pos + length + 2
+            if end > len(view):
+                break
+            self._entry(view[pos:end], self.offset + pos)
+            pos = end
+        return pos
+
+    def is_complete(self) -> bool:
+        """ true when everything fed so far was parsed """
+        return self.header_done and not self.broken and not self.pending
+
+    def _header(self, data: memoryview):
+        pass
+
+    def _entry(self, data: memoryview, file_index: int):
+        pass
+
+
+class DataLogStream(LogStream):
+    """ build a DataLog while the log is downloaded
+
+    Anything DataLog would not frame the same way stops the stream, result() is then
+    None and the log is parsed again once it is complete. """
+    def __init__(self):
+        super().__init__()
+        self.header = None
+        self.entries = []
+        self.crc_errors = 0
+
+    def _header(self, data: memoryview):
+        try:
+            self.header = CtLogHeader(data)
+        except ValueError as e:
+            logger.warning(f"log stream header {e}")
+            self.broken = True
+
+    def _entry(self, data: memoryview, file_index: int):
+        length = len(data) - 2
+        if data[0] != 165 or length < ENTRY_HEADER_SIZE or \
+                (length - ENTRY_HEADER_SIZE) % CT_RECORD_SIZE:
+            logger.warning(f"log stream lost entry framing @ {hex(file_index)}")
+            self.broken = True
+            return
+        entry = Entry(data, file_index)
+        if not entry.crc_ok:
+            self.crc_errors += 1
+        self.entries.append(entry)
+
+    def result(self, data: bytes):
+        """ the DataLog of data, the complete log that was fed """
+        if not self.is_complete() or self.offset != len(data):
+            return None
+        return DataLog.from_parts(self.header, self.entries,
+                                  bytes(data[CT_LOG_HEADER_SIZE:]))
+
+
 class DataLog():
     def __init__(self, data: bytes):
         if len(data) < CT_LOG_HEADER_SIZE:
@@ -307,25 +472,153 @@ class DataLog():
         self.header = CtLogHeader(data[:CT_LOG_HEADER_SIZE])
         self.entries = []
         self.entry_data = data[CT_LOG_HEADER_SIZE:]
+        entry_view = memoryview(self.entry_data)
+        crc = ReflectedData(data)
         i = 0
         file_index = CT_LOG_HEADER_SIZE
         while i < len(self.entry_data):
-            ent = Entry(self.entry_data[i:], file_index)
+            ent = Entry(entry_view[i:], file_index, crc)
             i += ent.get_offset()
             file_index = i + CT_LOG_HEADER_SIZE
             self.entries.append(ent)
 
+    @classmethod
+    def from_parts(cls, header: CtLogHeader, entries: List[Entry],
+                   entry_data: bytes):
+        """ a DataLog that was already parsed, see DataLogStream """
+        log = cls.__new__(cls)
+        log.header = header
+        log.entries = entries
+        log.entry_data = entry_data
+        return log
+
     def serialize(self, indent=None) -> str:
+        if indent is None:
+            return self._json()
         return json.dumps(self, cls=JsonEncoder, indent=indent)
 
+    def _json(self) -> str:
+        """ the document JsonEncoder writes, from templates instead of __dict__ """
+        ct_1 = self.header.ct_1
+        ct_2 = self.header.ct_2
+        header = HEADER_JSON % (
+            ct_1.entry_protocol_version, ct_1.entry_size, ct_1.entry_count,
+            ct_1.device_id, ct_1.device_time, ct_1.log_size, ct_1.last_upload,
+            ct_2.fw_version, ct_2.devices_seen, ct_2.network_id,
+            ct_2.ad_interval_ms, ct_2.log_interval_min, ct_2.scan_interval_sec,
+            ct_2.battery_level, ct_2.scan_dur_sec, ct_2.profile,
+            ct_2.rssi_threshold, ct_2.tx_power, ct_2.up_time_sec, ct_2.crc)
+        entries = []
+        for entry in self.entries:
+            h = entry.entry_header
+            entries.append(ENTRY_JSON %
+                           (h.flags, h.scan_interval, h.remote_device,
+                            h.timestamp, h.length, records_json(entry.rows)))
+        return f'{{"header": {header}, "entries": [{", ".join(entries)}]}}'
+
     def encode_mg100(self) -> bytes:
         return self.header.get_publish_hdr() + self.entry_data
 
+
+#DataLog.serialize() writes these and records_json(), they must stay the same as the JsonEncoder output
+HEADER_JSON = (
+    '{"ct_1": {"entry_protocol_version": %d, "entry_size": %d, "entry_count": %d, '
+    '"device_id": "%s", "device_time": %d, "log_size": %d, "last_upload": %d}, '
+    '"ct_2": {"fw_version": "%s", "devices_seen": %d, "network_id": %d, '
+    '"ad_interval_ms": %d, "log_interval_min": %d, "scan_interval_sec": %d, '
+    '"battery_level": %d, "scan_dur_sec": %d, "profile": %d, "rssi_threshold": %d, '
+    '"tx_power": %d, "up_time_sec": %d, "crc": "%s"}}')
+ENTRY_JSON = ('{"header": {"flags": %d, "scan_interval": %d, "remote_device": "%s", '
+              '"timestamp": %d, "length": %d}, "records": [%s]}')
+#the text of every byte value, a table lookup is faster than formatting an int
+U8_STR = [str(i) for i in range(256)]
+#indexed with the signed value, negative indexes wrap to the second half
+I8_STR = U8_STR[:128] + [str(i) for i in range(-128, 0)]
+
+
+def records_json(rows: List[tuple]) -> str:
+    return ", ".join([
+        f'{{"type": {U8_STR[t]}, "status": {U8_STR[status]}, "r1": {U8_STR[r1]}, '
+        f'"scanIntOff": {off}, "rssi": {I8_STR[rssi]}, "motion": {U8_STR[motion]}, '
+        f'"txPower": {U8_STR[tx_power]}}}'
+        for (t, status, r1, off, rssi, motion, tx_power) in rows
+    ])
+
+
 class JsonEncoder(json.JSONEncoder):
     """ custom JSON encoder for DataLog  """
     def default(self, obj):
         if isinstance(obj, Entry):
-            return {"header": obj.entry_header, "records": obj.records}
-        d = obj.__dict__
-        d.pop('entry_data', None)
-        return d
+            return {
+                "header": obj.entry_header,
+                "records": [dict(zip(RECORD_FIELDS, row)) for row in obj.rows]
+            }
+        if isinstance(obj, RssiTracking):
+            return obj.as_dict()
+        return {k: v for k, v in obj.__dict__.items() if k != 'entry_data'}
+
+
+if __name__ == "__main__":
+    import random
+    import hashlib
+    from .tracker_log import CtFile, CtJsonEncoder
+
+    def ct_log(entries: int, seed: int) -> bytes:
+        rand = random.Random(seed)
+
+        def randbytes(n: int) -> bytes:
+            return bytes(rand.randrange(256) for _ in range(n))
+
+        header = HEADER_P1.pack(1, 256, entries, randbytes(6), 1600000000, 0,
+                                1599990000) + HEADER_P2.pack(
+                                    randbytes(4), 5, 0xFFFF, 1000, 1, 10,
+                                    180, 3, 1, -90, 0, 12345)
+        data = header + struct.pack("<H", crc16_kermit(header))
+        for i in range(entries):
+            records = b"".join(
+                RECORD_FORMAT.pack(17, rand.randrange(2), 0, j,
+                                   rand.randint(-128, 127), rand.randrange(2),
+                                   rand.randrange(256))
+                for j in range(rand.randrange(24)))
+            entry = ENTRY_HEADER.pack(0xA5, rand.randrange(256), 10,
+                                      randbytes(6), 1600000000 + i * 60,
+                                      ENTRY_HEADER_SIZE + len(records))
+            entry += records
+            data += entry + struct.pack("<H", crc16_kermit(entry))
+        return data
+
+    #the templates against the encoders, then the speed of both
+    for seed in range(20):
+        data = ct_log(seed * 7, seed)
+        if seed == 3:
+            #an entry with a CRC error is written without records
+            data = data[:60] + bytes([data[60] ^ 1]) + data[61:]
+        log = DataLog(data)
+        assert log.serialize() == json.dumps(log, cls=JsonEncoder)
+        assert hasattr(log, "entry_data"), "the encoder must not change the log"
+        ct_file = CtFile(data)
+        assert ct_file.serialize() == json.dumps(ct_file, cls=CtJsonEncoder)
+    print("serializers match the JSON encoders")
+
+    #sha256 of what the JsonEncoder and CtJsonEncoder of the first release wrote for
+    #ct_log(40, 7), the encoders above could drift along with the templates
+    data = ct_log(40, 7)
+    for (name, text, frozen) in [
+        ("DataLog", DataLog(data).serialize(),
+         "d2607cb957b263636140a245fc14fe77f17b66befdab6038e89dfc73046aa10b"),
+        ("CtFile", CtFile(data).serialize(),
+         "963a1adc616f920daf57b87da9dafc3b0596fe332a6ce65bdd8ae21e48aa5f70")]:
+        assert hashlib.sha256(text.encode()).hexdigest() == frozen, \
+            f"{name} JSON differs from the first release"
+    print("serializers match the first release output")
+
+    data = ct_log(3000, 1)
+    log = DataLog(data)
+    ct_file = CtFile(data)
+    runs = 5
+    for (name, fn) in [
+        ("DataLog encoder", lambda: json.dumps(log, cls=JsonEncoder)),
+        ("DataLog template", log.serialize),
+        ("CtFile encoder", lambda: json.dumps(ct_file, cls=CtJsonEncoder)),
+        ("CtFile template", ct_file.serialize)]:
+        print(f"{name:17} {timeit.timeit(fn, number=runs) / runs * 1000:.1f} ms")
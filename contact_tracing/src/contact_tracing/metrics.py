@@ -0,0 +1,229 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Timings and counters of the pipeline stages, to tell whether a site is radio, CPU or
+# uplink bound. Stages: scan, decision, connect, smp_rtt (one SMP request to its
+# response), download, parse, serialize and publish. Everything is kept for one
+# report interval, a snapshot starts the next one.
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+#upper bounds of the histogram buckets, the last one is everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000,
+              60000)
+#devices with stats in one interval, the least recently active are dropped
+MAX_DEVICES = 256
+REPORT_INTERVAL = 5 * 60
+
+
+class Histogram():
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def quantile(self, q: float) -> float:
+        """ the upper bound of the bucket the quantile falls in, at most the max """
+        rank = q * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                break
+        bound = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return round(min(bound, self.max), 1)
+
+    def snapshot(self) -> dict:
+        return {
+            "n": self.count,
+            "mean_ms": round(self.total / self.count, 1),
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 1)
+        }
+
+
+class DeviceStats():
+    """ counters and stage times of one device, the mean and max of each stage """
+    __slots__ = ('counters', 'stages')
+
+    def __init__(self):
+        self.counters = Counter()
+        self.stages = {}
+
+    def add(self, stage: str, ms: float):
+        times = self.stages.get(stage)
+        if times:
+            times[0] += 1
+            times[1] += ms
+            times[2] = max(times[2], ms)
+        else:
+            self.stages[stage] = [1, ms, ms]
+
+    def snapshot(self) -> dict:
+        snapshot = dict(self.counters)
+        for (stage, (n, total, max_ms)) in self.stages.items():
+            snapshot[f"{stage}_ms"] = [round(total / n, 1), round(max_ms, 1)]
+        return snapshot
+
+
+class Metrics():
+    """ thread safe, the publishes are timed on the publisher threads. Gauges are
+    functions read at each snapshot, for queue depths and the counters other parts
+    keep themselves """
+    def __init__(self, max_devices: int = MAX_DEVICES):
+        self.max_devices = max_devices
+        self.lock = threading.Lock()
+        self.gauges = OrderedDict()
+        self.totals = Counter()
+        self.interval = REPORT_INTERVAL
+        self.dump_path = None
+        self._reset()
+
+    def _reset(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.counters = Counter()
+        self.devices = OrderedDict()
+
+    def _device(self, mac: str) -> DeviceStats:
+        device = self.devices.get(mac)
+        if device:
+            self.devices.move_to_end(mac)
+            return device
+        device = self.devices[mac] = DeviceStats()
+        if len(self.devices) > self.max_devices:
+            self.devices.popitem(last=False)
+        return device
+
+    def observe(self, stage: str, seconds: float, mac: str = None):
+        ms = seconds * 1000
+        with self.lock:
+            hist = self.stages.get(stage)
+            if not hist:
+                hist = self.stages[stage] = Histogram()
+            hist.add(ms)
+            if mac:
+                self._device(mac).add(stage, ms)
+
+    def count(self, name: str, n: int = 1, mac: str = None):
+        with self.lock:
+            self.counters[name] += n
+            self.totals[name] += n
+            if mac:
+                self._device(mac).counters[name] += n
+
+    @contextmanager
+    def timer(self, stage: str, mac: str = None):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start, mac)
+
+    def gauge(self, name: str, fn):
+        """ fn() is read at each snapshot, a number or a dict """
+        self.gauges[name] = fn
+
+    def snapshot(self, reset: bool = True) -> dict:
+        gauges = {}
+        for (name, fn) in self.gauges.items():
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = f"error {e}"
+        with self.lock:
+            secs = max(time.monotonic() - self.started, 1e-6)
+            snapshot = {
+                "interval_s": round(secs),
+                "stages": {k: h.snapshot() for (k, h) in self.stages.items()},
+                "counters": {
+                    k: {
+                        "n": n,
+                        "per_s": round(n / secs, 2),
+                        "total": self.totals[k]
+                    }
+                    for (k, n) in self.counters.items()
+                },
+                "gauges": gauges,
+                "devices": {mac: d.snapshot() for (mac, d) in self.devices.items()}
+            }
+            if reset:
+                self._reset()
+        return snapshot
+
+    def dump(self, snapshot: dict, path: str):
+        """ write a snapshot to a local file """
+        temp = path + ".tmp"
+        with open(temp, 'w') as fp:
+            json.dump(snapshot, fp, indent=2)
+        os.replace(temp, path)
+
+
+global_metrics = Metrics()
+
+
+def establish_metrics(interval_s: float = None, dump_path: str = None):
+    #snapshots go out every interval_s through client.status, and to dump_path if set
+    global_metrics.interval = interval_s or REPORT_INTERVAL
+    global_metrics.dump_path = dump_path
+
+
+async def report(metrics: Metrics, send):
+    """ send(snapshot) every interval, it must not block """
+    while True:
+        await asyncio.sleep(metrics.interval)
+        snapshot = metrics.snapshot()
+        if metrics.dump_path:
+            try:
+                metrics.dump(snapshot, metrics.dump_path)
+            except OSError as e:
+                logger.warning(f"metrics dump failed {e}")
+        try:
+            send({"metrics": snapshot})
+        except Exception as e:
+            logger.warning(f"metrics report failed {e}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    #print a dump: python -m contact_tracing.metrics /tmp/ct_metrics.json
+    with open(sys.argv[1], 'r') as fp:
+        snapshot = json.load(fp)
+    print(f"interval {snapshot['interval_s']}s")
+    for (stage, h) in snapshot["stages"].items():
+        print(f"  {stage:10} n {h['n']:6} mean {h['mean_ms']:9.1f} p50 {h['p50_ms']:7} "
+              f"p90 {h['p90_ms']:7} p99 {h['p99_ms']:7} max {h['max_ms']:9.1f} ms")
+    for (name, c) in snapshot["counters"].items():
+        print(f"  {name:20} {c['n']:8} {c['per_s']:9.2f}/s total {c['total']}")
+    for (name, value) in snapshot["gauges"].items():
+        print(f"  {name:20} {value}")
+    for (mac, device) in snapshot["devices"].items():
+        print(f"  {mac} {device}")
@@ -0,0 +1,307 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Store and forward for uploads. A downloaded log is appended to the outbox before it
+# is published, and replayed in order until a publish succeeds, so a lost uplink does
+# not cost another download from the tag.
+#
+# Records are appended to segment files, seg-<n>.log. Each record is
+#   <I length of the rest> <I crc32 of the rest> <H meta length> meta (JSON) data
+# index.json holds the segment and offset of the first record not yet published, and
+# how often publishing it failed. It is saved with the appends, so after a crash a
+# few records may be published again. Segments that are fully published are
+# deleted, the oldest are dropped when the outbox grows past its size limit. A
+# record that keeps failing is moved to dead.log, so it does not hold up the rest.
+import os
+import json
+import time
+import struct
+import asyncio
+import logging
+import zlib
+from collections import OrderedDict
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('<IIH')
+SEGMENT_SIZE = 1024 * 1024
+MAX_BYTES = 64 * 1024 * 1024
+#appends are made durable together, at most this long after the first of them
+FSYNC_INTERVAL = 1.0
+#parsed logs kept in memory for records not published yet, see append()
+MAX_HINTS = 8
+RETRY_MIN_S = 2
+RETRY_MAX_S = 5 * 60
+#failed publishes of one record before it goes to dead.log
+MAX_ATTEMPTS = 12
+DEAD_LETTERS = "dead.log"
+
+
+class Outbox():
+    def __init__(self,
+                 path: str,
+                 segment_size: int = SEGMENT_SIZE,
+                 max_bytes: int = MAX_BYTES,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_bytes = max(max_bytes, segment_size)
+        self.max_attempts = max_attempts
+        self.hints = OrderedDict()
+        self.wake = None
+        self.writer = None
+        self.peeked = None
+        self.unsynced = 0
+        self.first_unsynced = 0
+        self.index_dirty = False
+        os.makedirs(self.path, exist_ok=True)
+        self.segments = sorted(
+            int(name[4:-4]) for name in os.listdir(self.path)
+            if name.startswith("seg-") and name.endswith(".log"))
+        (self.read_seg, self.read_off, self.attempts) = self._load_index()
+        self._recover()
+
+    def _file(self, seg: int) -> str:
+        return os.path.join(self.path, f"seg-{seg:08d}.log")
+
+    def _load_index(self) -> Tuple[int, int, int]:
+        try:
+            with open(os.path.join(self.path, "index.json"), 'r') as fp:
+                index = json.load(fp)
+            return index["segment"], index["offset"], index.get("attempts", 0)
+        except (OSError, ValueError, KeyError):
+            return (self.segments[0] if self.segments else 0), 0, 0
+
+    def _save_index(self):
+        name = os.path.join(self.path, "index.json")
+        temp = name + ".tmp"
+        with open(temp, 'w') as fp:
+            json.dump(
+                {
+                    "segment": self.read_seg,
+                    "offset": self.read_off,
+                    "attempts": self.attempts
+                }, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp, name)
+        self.index_dirty = False
+
+    def _index_changed(self):
+        """ the index is saved by the next sync() """
+        if not self.unsynced and not self.index_dirty:
+            self.first_unsynced = time.monotonic()
+        self.index_dirty = True
+
+    def _records(self, seg: int, off: int = 0):
+        """ (offset, end, meta, data) of the valid records of a segment from off """
+        try:
+            with open(self._file(seg), 'rb') as fp:
+                fp.seek(off)
+                while True:
+                    head = fp.read(RECORD_HEADER.size)
+                    if len(head) < RECORD_HEADER.size:
+                        return
+                    (length, crc, meta_len) = RECORD_HEADER.unpack(head)
+                    body = fp.read(length - 2)
+                    if len(body) != length - 2 or zlib.crc32(
+                            head[8:] + body) != crc:
+                        logger.warning(f"outbox segment {seg} damaged at {off}")
+                        return
+                    end = off + RECORD_HEADER.size + len(body)
+                    yield (off, end, json.loads(body[:meta_len].decode()),
+                           body[meta_len:])
+                    off = end
+        except FileNotFoundError:
+            return
+
+    def _recover(self):
+        """ drop segments already published and cut a record left half written """
+        for seg in [s for s in self.segments if s < self.read_seg]:
+            self._remove(seg)
+        if self.read_seg not in self.segments:
+            (self.read_seg, self.read_off) = (self.segments[0], 0) \
+                if self.segments else (0, 0)
+            self.attempts = 0
+        self.pending = 0
+        for seg in self.segments:
+            end = self.read_off if seg == self.read_seg else 0
+            for (_, end, _, _) in self._records(seg, end):
+                self.pending += 1
+            if seg == self.segments[-1] and end < os.path.getsize(self._file(seg)):
+                logger.warning(f"outbox segment {seg} truncated to {end}")
+                os.truncate(self._file(seg), end)
+        if self.pending:
+            logger.info(f"outbox has {self.pending} records to publish")
+
+    def _remove(self, seg: int):
+        try:
+            os.remove(self._file(seg))
+        except FileNotFoundError:
+            pass
+        if seg in self.segments:
+            self.segments.remove(seg)
+
+    def size(self) -> int:
+        return sum(os.path.getsize(self._file(s)) for s in self.segments)
+
+    @staticmethod
+    def _record(meta: dict, data: bytes) -> bytes:
+        body = json.dumps(meta).encode()
+        meta_len = len(body)
+        body += data
+        crc = zlib.crc32(struct.pack('<H', meta_len) + body)
+        return RECORD_HEADER.pack(len(body) + 2, crc, meta_len) + body
+
+    def append(self, meta: dict, data: bytes, hint=None) -> int:
+        """ add a record, hint is kept in memory and handed back by peek() """
+        record = self._record(meta, data)
+        if self.writer is None or self.writer.tell() >= self.segment_size:
+            self._roll()
+        self.writer.write(record)
+        self.writer.flush()
+        if not self.unsynced and not self.index_dirty:
+            self.first_unsynced = time.monotonic()
+        self.unsynced += 1
+        self.pending += 1
+        key = (self.segments[-1], self.writer.tell() - len(record))
+        if hint is not None:
+            self.hints[key] = hint
+            while len(self.hints) > MAX_HINTS:
+                self.hints.popitem(last=False)
+        self._limit()
+        if self.wake:
+            self.wake.set()
+        return self.pending
+
+    def _roll(self):
+        """ start the next segment, or continue the last one after a restart """
+        if self.writer:
+            self.sync()
+            self.writer.close()
+        elif self.segments and \
+                os.path.getsize(self._file(self.segments[-1])) < self.segment_size:
+            self.writer = open(self._file(self.segments[-1]), 'ab')
+            return
+        seg = self.segments[-1] + 1 if self.segments else 1
+        self.segments.append(seg)
+        self.writer = open(self._file(seg), 'ab')
+
+    def sync(self):
+        if self.writer and self.unsynced:
+            os.fsync(self.writer.fileno())
+            self.unsynced = 0
+        if self.index_dirty:
+            self._save_index()
+
+    def sync_due(self) -> bool:
+        return (self.unsynced or self.index_dirty) and \
+            time.monotonic() - self.first_unsynced >= FSYNC_INTERVAL
+
+    def _limit(self):
+        """ drop the oldest segments while the outbox is too big """
+        while len(self.segments) > 1 and self.size() > self.max_bytes:
+            seg = self.segments[0]
+            dropped = sum(1 for r in self._records(
+                seg, self.read_off if seg == self.read_seg else 0))
+            logger.error(f"outbox full, dropping {dropped} unpublished records")
+            self.pending -= dropped
+            self._remove(seg)
+            if self.read_seg <= seg:
+                (self.read_seg, self.read_off) = (self.segments[0], 0)
+                self.attempts = 0
+                self._save_index()
+
+    def peek(self):
+        """ (meta, data, hint) of the oldest record not published, or None """
+        while True:
+            for (off, end, meta, data) in self._records(
+                    self.read_seg, self.read_off):
+                self.peeked = (self.read_seg, off, end)
+                return meta, data, self.hints.get((self.read_seg, off))
+            #the segment is done, move on unless it is the one being written
+            later = [s for s in self.segments if s > self.read_seg]
+            if not later:
+                return None
+            self._remove(self.read_seg)
+            (self.read_seg, self.read_off) = (later[0], 0)
+            self._save_index()
+
+    def ack(self):
+        """ the record from peek() was published """
+        (seg, off, end) = self.peeked
+        self.peeked = None
+        self.hints.pop((seg, off), None)
+        if (seg, off) != (self.read_seg, self.read_off):
+            #dropped by _limit while it was published
+            return
+        self.read_off = end
+        self.attempts = 0
+        self.pending -= 1
+        self._index_changed()
+
+    def fail(self, meta: dict, data: bytes) -> bool:
+        """ publishing the record from peek() failed. After max_attempts it is moved
+        to dead.log and True is returned """
+        self.attempts += 1
+        if self.attempts < self.max_attempts:
+            self._index_changed()
+            return False
+        self._dead_letter(meta, data)
+        self.ack()
+        return True
+
+    def _dead_letter(self, meta: dict, data: bytes):
+        """ keep the record for a look later, the file holds about one segment """
+        name = os.path.join(self.path, DEAD_LETTERS)
+        try:
+            if os.path.exists(name) and os.path.getsize(name) >= self.segment_size:
+                os.replace(name, name + ".old")
+            with open(name, 'ab') as fp:
+                fp.write(self._record(meta, data))
+        except OSError as e:
+            logger.error(f"outbox could not keep a dead letter {e}")
+
+
+async def replay(outbox: Outbox, publish):
+    """ publish the outbox in order. publish(meta, data, hint) raises on failure, the
+    same record is then tried again after a growing delay, up to max_attempts times """
+    outbox.wake = asyncio.Event()
+    delay = RETRY_MIN_S
+    while True:
+        if not outbox.pending:
+            outbox.sync()
+            outbox.wake.clear()
+            await outbox.wake.wait()
+            continue
+        if outbox.sync_due():
+            outbox.sync()
+        record = outbox.peek()
+        if record is None:
+            outbox.pending = 0
+            continue
+        (meta, data, hint) = record
+        try:
+            await publish(meta, data, hint)
+        except Exception as e:
+            if outbox.fail(meta, data):
+                logger.error(f"outbox publish failed {outbox.max_attempts} times, "
+                             f"moved to {DEAD_LETTERS}: {meta} {e}")
+                delay = RETRY_MIN_S
+                continue
+            logger.warning(
+                f"outbox publish failed, {outbox.pending} waiting, retry in {delay}s: {e}"
+            )
+            outbox.sync()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_S)
+            continue
+        delay = RETRY_MIN_S
+        outbox.ack()
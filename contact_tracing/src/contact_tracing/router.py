@@ -0,0 +1,160 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Routes the SmartBasic responses of the connections to their devices.
+# NOTE: the line formats are SmartBasic specific, see sb_smp/smp.cmd.sb
+import asyncio
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+HANDLE_LEN = 8
+MAC_LEN = 14
+#a failing write repeats on every request, it is logged once per handle in this time
+WRITE_ERROR_LOG_S = 60
+
+
+class LineQueue(asyncio.Queue):
+    """ bounded for data lines only. A data line for a full queue is refused like
+    put_nowait does, any other line takes the place of the oldest data line: a flood
+    of notifications or adverts must not hide a connect, disconnect or scan end """
+    def __init__(self, maxsize: int, data: tuple):
+        super().__init__(maxsize=maxsize)
+        #prefixes of the lines that may be dropped
+        self.data = data
+
+    def put_line(self, line):
+        """ returns the data line given up for it, or None """
+        if not self.full():
+            self.put_nowait(line)
+            return None
+        if line.startswith(self.data):
+            raise asyncio.QueueFull
+        #the queue only holds control lines when nothing reads it, the oldest goes then
+        evicted = next((q for q in self._queue if q.startswith(self.data)),
+                       self._queue[0])
+        self._queue.remove(evicted)
+        self.task_done()
+        self.put_nowait(line)
+        return evicted
+
+
+class Router():
+    """ one dictionary lookup on the token before the ':' picks the route, a MAC or
+    handle lookup picks the device. Devices are registered by MAC, a connection handle
+    is tied to its device by the connA response and dropped by dconnH or unregister.
+    Lines no device is waiting for, and notifications for a full device queue, are
+    counted and dropped. """
+    def __init__(self):
+        self.by_mac = {}
+        self.by_handle = {}
+        self.dropped = Counter()
+        #handle -> when its write error was last logged, and the errors since
+        self.write_errors = {}
+        self.routes = {
+            "evt_hvx": self._handle,
+            "dconnH": self._disconnected,
+            "connA": self._connected,
+            "writec": self._last,
+            "con": self._mac,
+            "dCon": self._mac,
+            #echo of a gattc write
+            "##": self._ignore,
+            "## writexE": self._write_error,
+            "## writeE": self._write_error,
+        }
+
+    def register(self, mac: str, device):
+        """ device needs a get_queue() """
+        self.by_mac[mac] = device
+
+    def unregister(self, mac: str):
+        device = self.by_mac.pop(mac, None)
+        for handle in [h for (h, d) in self.by_handle.items() if d is device]:
+            del self.by_handle[handle]
+
+    def get(self, mac: str):
+        return self.by_mac.get(mac)
+
+    def __contains__(self, mac: str) -> bool:
+        return mac in self.by_mac
+
+    def __len__(self) -> int:
+        return len(self.by_mac)
+
+    def route(self, resp: str, last: str) -> bool:
+        """ last is the MAC being connected, it gets writec and dconnTO """
+        (prefix, colon, rest) = resp.partition(":")
+        if not colon:
+            if resp == "dconnTO\n":
+                return self._last(resp, rest, last)
+            return self._drop(resp, "other")
+        route = self.routes.get(prefix)
+        if not route:
+            return self._drop(resp, prefix)
+        return route(resp, rest, last)
+
+    def _deliver(self, device, resp: str, kind: str) -> bool:
+        if not device:
+            return self._drop(resp, kind)
+        try:
+            evicted = device.get_queue().put_line(resp)
+        except asyncio.QueueFull:
+            return self._drop(resp, "device queue full")
+        if evicted:
+            self._drop(evicted, "device queue full")
+        return True
+
+    def _drop(self, resp: str, kind: str) -> bool:
+        if not self.dropped[kind]:
+            logger.info(f"dropping {kind} responses, first: {repr(resp)}")
+        self.dropped[kind] += 1
+        return False
+
+    def _handle(self, resp: str, rest: str, last: str) -> bool:
+        return self._deliver(self.by_handle.get(rest[:HANDLE_LEN]), resp,
+                             "unknown handle")
+
+    def _disconnected(self, resp: str, rest: str, last: str) -> bool:
+        device = self.by_handle.pop(rest[:HANDLE_LEN], None)
+        return self._deliver(device, resp, "unknown handle")
+
+    def _connected(self, resp: str, rest: str, last: str) -> bool:
+        device = self.by_mac.get(rest[:MAC_LEN])
+        if not device:
+            return self._drop(resp, "unknown mac")
+        self.by_handle[rest[MAC_LEN + 1:MAC_LEN + 1 + HANDLE_LEN]] = device
+        return True
+
+    def _last(self, resp: str, rest: str, last: str) -> bool:
+        return self._deliver(self.by_mac.get(last), resp, "not connecting")
+
+    def _mac(self, resp: str, rest: str, last: str) -> bool:
+        return self._deliver(self.by_mac.get(rest[:MAC_LEN]), resp,
+                             "unknown mac")
+
+    def _write_error(self, resp: str, rest: str, last: str) -> bool:
+        """ the module refused a gattc write, the download of that handle stalls """
+        self.dropped["write error"] += 1
+        handle = rest.split(" ", 1)[0]
+        (logged, count) = self.write_errors.get(handle, (None, 0))
+        now = time.monotonic()
+        if logged is None or now - logged >= WRITE_ERROR_LOG_S:
+            suppressed = f", {count} not logged since the last" if count else ""
+            logger.warning(f"gattc write failed on handle {handle}{suppressed}: {repr(resp)}")
+            self.write_errors[handle] = (now, 0)
+        else:
+            self.write_errors[handle] = (logged, count + 1)
+        return False
+
+    def _ignore(self, resp: str, rest: str, last: str) -> bool:
+        self.dropped["echo"] += 1
+        return False
@@ -0,0 +1,69 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+import logging
+from collections import namedtuple
+from typing import Dict, List
+import sb.adv as bt_adv
+
+logger = logging.getLogger(__name__)
+
+#tags kept per scan window, adverts from others are counted but not kept
+MAX_TAGS = 512
+
+#a ScanRes for the whole scan window. rssi is the mean of the adverts, the flags, epoch
+#and data are from the last one
+ScanSummary = namedtuple('ScanSummary',
+                         bt_adv.ScanRes._fields + ('rssi_max', 'rssi_last', 'count'))
+
+
+class TagAdverts():
+    __slots__ = ('last', 'count', 'rssi_sum', 'rssi_max')
+
+    def __init__(self, adv: bt_adv.ScanRes):
+        self.last = adv
+        self.count = 1
+        self.rssi_sum = adv.rssi
+        self.rssi_max = adv.rssi
+
+    def add(self, adv: bt_adv.ScanRes):
+        self.last = adv
+        self.count += 1
+        self.rssi_sum += adv.rssi
+        if adv.rssi > self.rssi_max:
+            self.rssi_max = adv.rssi
+
+    def summary(self) -> ScanSummary:
+        return ScanSummary(*self.last._replace(rssi=self.rssi_sum / self.count),
+                           self.rssi_max, self.last.rssi, self.count)
+
+
+class ScanAggregator():
+    """ one record per tag for a scan window, however often it advertises """
+    def __init__(self, max_tags: int = MAX_TAGS):
+        self.max_tags = max_tags
+        self.tags: Dict[str, TagAdverts] = {}
+        self.adverts = 0
+        self.dropped = 0
+
+    def add(self, adv: bt_adv.ScanRes):
+        self.adverts += 1
+        tag = self.tags.get(adv.mac)
+        if tag:
+            tag.add(adv)
+        elif len(self.tags) < self.max_tags:
+            self.tags[adv.mac] = TagAdverts(adv)
+        else:
+            self.dropped += 1
+
+    def summary(self) -> List[ScanSummary]:
+        """ the tags in the order they were first seen """
+        if self.dropped:
+            logger.warning(
+                f"scan window full, {self.dropped} adverts from other tags dropped")
+        return [tag.summary() for tag in self.tags.values()]
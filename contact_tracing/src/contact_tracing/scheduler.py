@@ -0,0 +1,159 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+#
+# Picks which of the tags that qualify in a scan are downloaded next.
+#
+# Each tag gets a score from how long it has waited since its last download, the RSSI
+# it is expected to have when connecting, its low battery and motion flags and its
+# recent failures. A tag that has waited longer than the starvation time goes ahead of
+# every tag that has not, oldest first, so no tag waits much longer than that while
+# it is in range.
+import time
+import logging
+from collections import deque
+from typing import Dict, List
+import sb.adv as bt_adv
+
+logger = logging.getLogger(__name__)
+
+STARVATION_S = 15 * 60
+#score per minute waited
+AGE_WEIGHT = 1.0
+#score per dB of expected RSSI above the floor
+RSSI_WEIGHT = 0.5
+RSSI_SAMPLES = 5
+#a tag with a low battery may stop logging, a moving tag may leave range
+LOW_BATT_BONUS = 10.0
+MOTION_BONUS = 5.0
+FAILURE_PENALTY = 10.0
+#failures count half as much after this time
+FAILURE_HALF_LIFE_S = 5 * 60
+#tags not seen for this long are forgotten
+FORGET_S = 24 * 60 * 60
+
+
+class TagState():
+    """ what the scheduler knows about one tag """
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.last_seen = now
+        self.last_success = 0
+        self.rssi = deque(maxlen=RSSI_SAMPLES)
+        self.failures = 0.0
+        self.failed_at = 0
+
+    def waiting(self, now: float) -> float:
+        return now - (self.last_success or self.first_seen)
+
+    def expected_rssi(self) -> float:
+        """ the average of the recent samples, moved along their trend """
+        average = sum(self.rssi) / len(self.rssi)
+        if len(self.rssi) < 2:
+            return average
+        trend = (self.rssi[-1] - self.rssi[0]) / (len(self.rssi) - 1)
+        return average + trend
+
+    def recent_failures(self, now: float) -> float:
+        if not self.failures:
+            return 0.0
+        return self.failures * 0.5**((now - self.failed_at) / FAILURE_HALF_LIFE_S)
+
+
+class Scheduler():
+    def __init__(self, rssi_floor: int, starvation_s: float = STARVATION_S):
+        self.rssi_floor = rssi_floor
+        self.starvation_s = starvation_s
+        self.tags: Dict[str, TagState] = {}
+
+    def _state(self, mac: str, now: float) -> TagState:
+        state = self.tags.get(mac)
+        if not state:
+            state = self.tags[mac] = TagState(now)
+        return state
+
+    def score(self, target: bt_adv.ScanRes, now: float) -> float:
+        state = self.tags[target.mac]
+        score = AGE_WEIGHT * state.waiting(now) / 60
+        score += RSSI_WEIGHT * (state.expected_rssi() - self.rssi_floor)
+        if target.low_batt:
+            score += LOW_BATT_BONUS
+        if target.motion:
+            score += MOTION_BONUS
+        score -= FAILURE_PENALTY * state.recent_failures(now)
+        return score
+
+    def _rank(self, target: bt_adv.ScanRes, now: float) -> tuple:
+        waiting = self.tags[target.mac].waiting(now)
+        if waiting >= self.starvation_s:
+            return (1, waiting)
+        return (0, self.score(target, now))
+
+    def select(self, targets: List[bt_adv.ScanRes], count: int,
+               now: float = None) -> List[str]:
+        """ the macs of the count best targets, a tag may be in targets more than once """
+        if now is None:
+            now = time.time()
+        latest = {}
+        for target in targets:
+            latest[target.mac] = target
+        for target in latest.values():
+            state = self._state(target.mac, now)
+            state.last_seen = now
+            state.rssi.append(target.rssi)
+        ranked = sorted(latest.values(),
+                        key=lambda t: self._rank(t, now),
+                        reverse=True)
+        self._forget(now)
+        selected = [t.mac for t in ranked[:count]]
+        if len(ranked) > count:
+            logger.debug(
+                f"scheduled {selected}, waiting {[t.mac for t in ranked[count:]]}"
+            )
+        return selected
+
+    def success(self, mac: str, now: float = None):
+        if now is None:
+            now = time.time()
+        state = self._state(mac, now)
+        state.last_success = now
+        state.failures = 0.0
+
+    def failure(self, mac: str, now: float = None):
+        if now is None:
+            now = time.time()
+        state = self._state(mac, now)
+        state.failures = state.recent_failures(now) + 1
+        state.failed_at = now
+
+    def _forget(self, now: float):
+        for mac in [
+                mac for (mac, state) in self.tags.items()
+                if now - state.last_seen > FORGET_S
+        ]:
+            del self.tags[mac]
+
+
+if __name__ == "__main__":
+    #one radio, three tags in range: the strong tag goes first, the others are not starved
+    scheduler = Scheduler(-80, starvation_s=600)
+    tags = [
+        bt_adv.ScanRes("01000000000001", "", -50, 0, True, True, False, False),
+        bt_adv.ScanRes("01000000000002", "", -75, 0, True, True, False, False),
+        bt_adv.ScanRes("01000000000003", "", -78, 0, True, True, False, True)
+    ]
+    last = {}
+    for cycle in range(120):
+        now = 1000 + cycle * 60.0
+        (mac, ) = scheduler.select(tags, 1, now)
+        scheduler.success(mac, now)
+        if mac in last:
+            assert now - last[mac] <= 600 + 3 * 60, f"{mac} starved"
+        last[mac] = now
+    assert len(last) == len(tags)
+    print("no tag waited longer than the starvation time")
@@ -13,7 +13,8 @@ import binascii
 import logging
 import time
 import sb.command as bt
-from typing import Tuple
+from .metrics import global_metrics
+from typing import List, Tuple
 logger = logging.getLogger(__name__)
 
 
@@ -107,14 +108,19 @@ class SmpFileChunk():
         except Exception as e:
             logger.error(f"smp File Chunk {e}")
             raise SmpError("could not parse SMP file header", {})
-        self.raw_data = b""
+        self.raw_data = bytearray(self.length)
         self.cur_len = 0
         self.mac_addr = mac
         logger.debug(f"{self.mac_addr} new chunk -> len:{self.length}")
 
     def add_data(self, data: bytes) -> bool:
-        self.raw_data += data
-        self.cur_len += len(data)
+        end = min(self.cur_len + len(data), self.length)
+        if end - self.cur_len != len(data):
+            logger.warning(
+                f"{self.mac_addr} chunk overflow -> len:{self.length} dropped: {len(data) - (end - self.cur_len)}"
+            )
+        memoryview(self.raw_data)[self.cur_len:end] = data[:end - self.cur_len]
+        self.cur_len = end
         logger.debug(
             f"{self.mac_addr} chunk add data -> len:{self.length} current len: {self.cur_len} seq:{self.seq}  "
         )
@@ -125,7 +131,8 @@ class SmpFileChunk():
 
     def _decode(self):
         self.payload = cbor.loads(self.raw_data)
-        if self.payload["rc"]:
+        self.raw_data = None
+        if self.payload.get("rc"):
             rc = self.payload["rc"]
             if rc != 0:
                 logger.error(f"rc error{self.mac_addr}  -> {self.payload} ")
@@ -154,9 +161,34 @@ cmd_bin = {
 
 
 class SmpFileResp():
-    def __init__(self, mac: str, file_name: str = "/lfs/params.txt"):
+    """ download a file with up to window Download requests in flight
+
+    The first request (off=0) returns the file length and the chunk size the device
+    uses. After that, requests are issued at computed offsets, each with its own
+    sequence number. Responses are placed by their offset, so lost or late responses
+    only cost a retransmit of the missing offsets. The window is halved when responses
+    are lost and grows by one for every window of responses that arrive.
+
+    The file is reassembled in a single buffer allocated from the length in the first
+    response. Each chunk is copied in at its offset and then dropped. A range of the
+    file can be left out with skip(), the buffer then holds the file without it. """
+    def __init__(self,
+                 mac: str,
+                 file_name: str = "/lfs/params.txt",
+                 window: int = 1,
+                 on_start=None,
+                 on_data=None):
         self.file_name = file_name
-        self.chunks = []
+        #called once the first response has arrived, may call resume()
+        self.on_start = on_start
+        #called with each part of the buffer as it becomes complete, in order
+        self.on_data = on_data
+        self.delivered = 0
+        self.buffer = bytearray()
+        self.received = {}
+        self.contiguous = 0
+        self.skip_from = 0
+        self.skip_to = 0
         self.seq = 0
         self.new = True
         self.cur_len = 0
@@ -164,29 +196,70 @@ class SmpFileResp():
         self.mac = mac
         self.complete = False
         self.start = time.time()
+        self.max_window = max(1, window)
+        self.window = self.max_window
+        self.chunk_size = 0
+        self.next_off = 0
+        self.outstanding = {}
+        #when each outstanding request was sent, for the round trip times
+        self.sent = {}
+        self.retry = []
+        self.acked = 0
+        self.retransmits = 0
         super().__init__()
 
-    def _decode(self) -> None:
-        ret = b""
-        for chunk in self.chunks:
-            if chunk.payload["data"]:
-                ret += chunk.payload["data"]
-        return ret
+    def _decode(self) -> bytearray:
+        #an rc error ends the transfer early, keep what arrived in order
+        end = self._pos(self.contiguous)
+        if end < len(self.buffer):
+            del self.buffer[end:]
+        return self.buffer
+
+    def _pos(self, off: int) -> int:
+        """ buffer position of a file offset """
+        if off < self.skip_from:
+            return off
+        return max(off - (self.skip_to - self.skip_from), self.skip_from)
+
+    def _off(self, pos: int) -> int:
+        """ file offset of a buffer position """
+        if pos < self.skip_from:
+            return pos
+        return pos + (self.skip_to - self.skip_from)
+
+    def _advance(self):
+        """ move the in order mark past received data and the skipped range """
+        while True:
+            if self.skip_from <= self.contiguous < self.skip_to:
+                self.contiguous = self.skip_to
+            elif self._covered(self.contiguous) > self.contiguous:
+                self.contiguous = self._covered(self.contiguous)
+            else:
+                break
+
+    def _covered(self, off: int) -> int:
+        """ end of the received data that off falls in, a gap fill overlaps the next response """
+        if off in self.received:
+            return off + self.received[off]
+        return max([
+            start + length for (start, length) in self.received.items()
+            if start < off < start + length
+        ], default=off)
 
     def _add_chunk(self, data: bytes):
         """ add the data to the current chunk """
         if self.new:
             self.cur_chunk = SmpFileChunk(self.mac, data[:SMP_HEADER_SIZE])
+            self.new = False
             self.cur_chunk.add_data(data[SMP_HEADER_SIZE:])
-            self.seq = self.cur_chunk.seq
         else:
             self.cur_chunk.add_data(data)
-        self.new = False
 
     def _get_total_length(self):
         """ The first Chunk shall contain the total length of the file """
         if self.file_len == 0:
             self.file_len = self.cur_chunk.payload["len"]
+            self.buffer = bytearray(self.file_len)
 
     def _complete_actions(self):
         """ When the complete file is received, take these actions """
@@ -195,42 +268,191 @@ class SmpFileResp():
         dur_ms = (time.time() - self.start) * 1000
         len_ret = len(self.ret)
         logger.info(
-            f"smp download complete - duration(ms): {dur_ms : .3f}  length(B): {len_ret}  Bytes/sec: {len_ret/(dur_ms/1000) :.2f}"
+            f"smp download complete - duration(ms): {dur_ms : .3f}  length(B): {len_ret}  Bytes/sec: {len_ret/(dur_ms/1000) :.2f}  window: {self.window}  retransmits: {self.retransmits}"
         )
 
+    def _copy(self, off: int, data) -> int:
+        """ copy the parts of data that are not skipped, returns the bytes kept """
+        end = off + len(data)
+        kept = 0
+        view = memoryview(self.buffer)
+        for (start, stop) in [(off, min(end, self.skip_from)),
+                              (max(off, self.skip_to), end)]:
+            if start < stop:
+                pos = self._pos(start)
+                view[pos:pos + stop - start] = data[start - off:stop - off]
+                kept += stop - start
+        return kept
+
+    def _place(self, off: int, data: bytes):
+        """ copy the data into the buffer, and request any gap left by a short response """
+        if off in self.received:
+            return
+        end = min(off + len(data), self.file_len)
+        self.cur_len += self._copy(off, memoryview(data)[:end - off])
+        self.received[off] = end - off
+        self._advance()
+        if off in self.retry:
+            self.retry.remove(off)
+        if self.chunk_size and end - off < self.chunk_size and end < self.file_len \
+                and self._covered(end) == end and end not in self.retry:
+            self.retry.append(end)
+
+    def skip(self, start: int, end: int):
+        """ leave bytes start to end of the file out of the download """
+        end = min(end, self.file_len)
+        if end <= start:
+            return
+        received = self.buffer
+        self.skip_from = start
+        self.skip_to = end
+        self.buffer = bytearray(self.file_len - (end - start))
+        self.cur_len = 0
+        #place what already arrived again, without the skipped range
+        for (off, length) in self.received.items():
+            self.cur_len += self._copy(off,
+                                       memoryview(received)[off:off + length])
+        self._advance()
+        if self.skip_from <= self.next_off < self.skip_to:
+            self.next_off = self.skip_to
+        self.retry = [
+            off for off in self.retry
+            if off < self.skip_from or off >= self.skip_to
+        ]
+        logger.info(f"{self.mac} smp download skips {start} to {end}")
+
+    def resume(self, data: bytes):
+        """ fill the start of the buffer from an earlier, interrupted download """
+        start = self._pos(self.contiguous)
+        end = min(len(data), len(self.buffer))
+        if end <= start:
+            return
+        memoryview(self.buffer)[start:end] = memoryview(data)[start:end]
+        self.cur_len += end - start
+        self.received[self._off(start)] = self._off(end) - self._off(start)
+        self._advance()
+        self.next_off = max(self.next_off, self.contiguous)
+        self.retry = [off for off in self.retry if off >= self.contiguous]
+        logger.info(
+            f"{self.mac} smp download resumed at {self.contiguous} of {self.file_len}"
+        )
+
+    def _deliver(self):
+        end = self._pos(self.contiguous)
+        if self.on_data and end > self.delivered:
+            self.on_data(memoryview(self.buffer)[self.delivered:end])
+        self.delivered = end
+
+    def head(self) -> memoryview:
+        """ the part of the buffer received in order so far """
+        return memoryview(self.buffer)[:self._pos(self.contiguous)]
+
+    def _grow_window(self):
+        self.acked += 1
+        if self.acked >= self.window:
+            self.acked = 0
+            self.window = min(self.max_window, self.window + 1)
+
+    def _expected(self, data: bytes) -> bool:
+        """ data starts the response to an outstanding request """
+        if len(data) < SMP_HEADER_SIZE:
+            return False
+        (op, _, _, group, seq, _) = unpack('>BBHHBB', data[:SMP_HEADER_SIZE])
+        return op == Op.MGMT_OP_READ_RSP.value \
+            and group == Group.MGMT_GROUP_ID_FS.value and seq in self.outstanding
+
     def data(self, data: bytes) -> bool:
+        if self.new and not self._expected(data):
+            #the rest of a response given up by lost(), its offset is requested again
+            logger.debug(f"{self.mac} dropping notification, not an outstanding response")
+            return False
         try:
             self._add_chunk(data)
         except SmpError as e:
             logger.debug(f"except SmpError {e}")
+            self.new = True
             #for an rc error - just wrap things up and close the connection
             #is_complete should be true  - this is set by the chunk rc check
             self._complete_actions()
             return True
+        except Exception as e:
+            #a late notification mixed into the response, it is requested again
+            logger.warning(f"{self.mac} dropping undecodable smp response {e}")
+            self.new = True
+            self.cur_chunk = None
+            return False
 
         if not self.cur_chunk.is_complete():
             return False
+        self.new = True
 
+        payload = self.cur_chunk.payload
+        self._ack(self.cur_chunk.seq)
         self._get_total_length()
-        if self.cur_chunk.payload['data']:
-            self.cur_len += len(self.cur_chunk.payload['data'])
+        if payload.get('data'):
+            off = payload.get('off', 0)
+            first = not self.chunk_size
+            if first:
+                self.chunk_size = len(payload['data'])
+                self.next_off = self.chunk_size
             logger.debug(
-                f"smp decode - {[ k  for k in self.cur_chunk.payload.items() if k[0] != 'data' ]} :total_length {self.file_len} current length: {self.cur_len}"
+                f"smp decode - {[ k  for k in payload.items() if k[0] != 'data' ]} :total_length {self.file_len} current length: {self.cur_len}"
             )
-            self.chunks.append(self.cur_chunk)
+            self._place(off, payload['data'])
+            self._grow_window()
+            if first and self.on_start:
+                self.on_start(self)
+            self._deliver()
         else:
-            logger.error(f"unexpected chunk {self.cur_len.payload}")
-        if self.cur_len == self.file_len:
+            logger.error(f"unexpected chunk {self.cur_chunk}")
+        #the data has been copied, the chunk is not needed anymore
+        self.cur_chunk = None
+        #cur_len counts overlapping responses twice, only coverage completes the file
+        if self.contiguous >= self.file_len:
             self._complete_actions()
-        self.new = True
         return True
 
-    def read(self) -> bytes:
+    def _ack(self, seq: int):
+        """ the device answers in order, requests sent before this one were lost """
+        if seq not in self.outstanding:
+            return
+        global_metrics.observe("smp_rtt", time.monotonic() - self.sent.pop(seq),
+                               self.mac)
+        skipped = []
+        for pending in self.outstanding:
+            if pending == seq:
+                break
+            skipped.append(pending)
+        if skipped:
+            self._requeue(skipped)
+        self.outstanding.pop(seq)
+
+    def _requeue(self, seqs):
+        """ shrink the window and request the offsets again """
+        self.window = max(1, self.window // 2)
+        self.acked = 0
+        for seq in seqs:
+            off = self.outstanding.pop(seq)
+            self.sent.pop(seq, None)
+            if off not in self.received and off not in self.retry:
+                self.retry.append(off)
+        self.retransmits += len(seqs)
+        self.retry.sort()
+        logger.debug(f"{self.mac} smp response lost - window: {self.window} retry: {self.retry}")
+
+    def lost(self):
+        """ no response arrived in time - everything outstanding is requested again """
+        self.new = True
+        self._requeue(list(self.outstanding))
+        if not self.chunk_size and not self.retry:
+            self.retry.append(0)
+
+    def read(self) -> bytearray:
         return self.ret
 
     def __repr__(self) -> str:
         ret = f"smp file  -> "
-        ret += f"chunks :{self.chunks} "
+        ret += f"received :{self.cur_len}/{self.file_len} "
         return ret
 
     def _seq_inc(self):
@@ -239,16 +461,41 @@ class SmpFileResp():
         else:
             self.seq += 1
 
-    def _get_cbor_header(self) -> bytes:
-        self._seq_inc()
-        return Download(self.file_name, self.cur_len, self.seq).dumps()
+    def _get_cbor_header(self, off: int, seq: int) -> bytes:
+        return Download(self.file_name, off, seq).dumps()
 
-    @bt.gattc_wrap
-    def get_cmd(self, conn: str):
-        return conn, self._get_cbor_header()
+    def _request(self, off: int) -> bytes:
+        """ the next request, registered as outstanding """
+        self._seq_inc()
+        self.outstanding[self.seq] = off
+        self.sent[self.seq] = time.monotonic()
+        return self._get_cbor_header(off, self.seq)
+
+    def _next_request(self) -> int:
+        """ offset of the next request, retransmits first """
+        if self.retry:
+            return self.retry.pop(0)
+        if self.chunk_size and self.next_off < self.file_len:
+            off = self.next_off
+            self.next_off += self.chunk_size
+            if self.skip_from <= self.next_off < self.skip_to:
+                self.next_off = self.skip_to
+            return off
+        return None
+
+    def get_cmds(self, conn: str) -> List[bytes]:
+        """ commands that fill the window back up """
+        cmds = []
+        while len(self.outstanding) < self.window:
+            off = self._next_request()
+            if off is None:
+                break
+            cmds.append(bt.get_gattc_write(conn, self._request(off)))
+        return cmds
 
     def get_cbor_header_debug(self) -> str:
-        ret = self.get_cbor_header()
+        """ the request for cur_len with the next sequence number, nothing is sent """
+        ret = self._get_cbor_header(self.cur_len, (self.seq + 1) & 0xFF)
         return "".join(["{:02x} ".format(i) for i in ret])
 
     def is_complete(self) -> bool:
@@ -258,6 +505,10 @@ class SmpFileResp():
     def get_file_cmd(self, conn: str):
         cmd = cmd_bin.get(self.file_name,
                           Download(self.file_name, 0, 0).seralize())
+        #the canned requests carry their own sequence number
+        self.seq = cmd[6]
+        self.outstanding[self.seq] = 0
+        self.sent[self.seq] = time.monotonic()
         return conn, cmd
 
 
@@ -10,107 +10,162 @@
 import logging
 import asyncio
 import aioserial
-from typing import List
+from typing import Set
 
 import sb.command as bt_cmd
-import sb.response as bt_resp
 import sb.adv as bt_adv
 from .adv_time import adv_time
-from .decision import decision
+from .decision import decision, get_max_con
 from .btx10ct import Bt510Ct
+from .scan_window import ScanAggregator
+from .router import Router
+from .uart_reader import UartReader
+from .outbox import replay
+from .metrics import global_metrics, report
+from publisher import DROP_NEWEST
 
 logger = logging.getLogger(__name__)
 
+SCAN_TIMEOUT = 2.2
+#idle time between scan windows, leaves the radio to the active links
+SCAN_INTERVAL = 1.0
+CANDIDATE_QUEUE_SIZE = 16
 
-async def arbiter(aioserial_instance: aioserial.AioSerial, targets):
-    """ receive all serial responses - send to specific device NOTE: This implementation is SmartBasic specific """
-
-    handle_to_mac = {}
-    while True:
-        resp = (await
-                aioserial_instance.read_until_async()).decode(errors='ignore')
 
+async def download(inst: aioserial.AioSerial, candidates: asyncio.Queue,
+                   router: Router, pending: Set[str], conn_lock: asyncio.Lock,
+                   link_slots: asyncio.Semaphore):
+    """ pull targets from the candidate queue and start a download as soon as a link slot frees up """
+    async def run(t: Bt510Ct):
         try:
-            bt_ident = bt_resp.handle_resp(resp, Bt510Ct.last_conn_mac)
-            if bt_ident.mac:
-                #here is the SB specific portion
-                if resp.startswith("connA"):
-                    handle_to_mac[bt_ident.handle] = bt_ident.mac
-                else:
-                    q = targets[bt_ident.mac].get_queue()
-                    await q.put(resp)
-            else:
-                this_mac = handle_to_mac[bt_ident.handle]
-                q = targets[this_mac].get_queue()
-                await q.put(resp)
-
+            await t.work()
         except Exception as e:
-            if resp.startswith("##"):
-                logger.warning(repr(resp))
-            else:
-                logger.error(f'receive exception ->  {e} - {repr(resp)}  ')
+            logger.error(f'download exception {t.mac} -> {e}')
+        finally:
+            link_slots.release()
+            router.unregister(t.mac)
+            pending.discard(t.mac)
 
-
-async def create_tasks(*target_list: bt_adv.ScanRes,
-                       inst: aioserial.AioSerial):
-    if len(target_list) == 0:
-        return
-    logger.debug("starting connections ")
-    conn_lock = asyncio.Lock()
-    targets = {}
-    tasks = []
-    for target in target_list:
-        logger.debug(f"connecting to {target} ")
-        t = Bt510Ct(target, inst, conn_lock)
-        targets[target] = t
-        task = asyncio.create_task(t.work())
-        tasks.append(task)
-
-    rec_task = asyncio.create_task(arbiter(inst, targets))
-    ret = await asyncio.gather(*tasks, return_exceptions=True)
-    if ret:
-        logger.info(ret)
-    rec_task.cancel()
-
-
-async def scan_and_filter(inst: aioserial.AioSerial):
-    target_list = []
+    while True:
+        mac = await candidates.get()
+        await link_slots.acquire()
+        logger.debug(f"connecting to {mac} ")
+        t = Bt510Ct(mac, inst, conn_lock)
+        router.register(mac, t)
+        asyncio.create_task(run(t))
+        candidates.task_done()
+
+
+async def scan_and_filter(inst: aioserial.AioSerial,
+                          scan_queue: asyncio.Queue,
+                          candidates: asyncio.Queue, pending: Set[str]):
+    """ scan continuously, handing qualifying targets to the download stage """
     while True:
         #before scaning, start advertising time
         adv = bt_cmd.advertise(adv_time())
         await inst.write_async(adv)
+        window = ScanAggregator()
         try:
-            target_list = await asyncio.wait_for(scan(inst), timeout=2.2)
+            with global_metrics.timer("scan"):
+                await asyncio.wait_for(scan(inst, scan_queue, window),
+                                       timeout=SCAN_TIMEOUT)
         except asyncio.TimeoutError:
+            #the adverts collected before the timeout are still used
             logger.warning("scan timeout")
-            pass
+            global_metrics.count("scan_timeout")
+        global_metrics.count("adverts", window.adverts)
+        global_metrics.count("adverts_dropped", window.dropped)
+        logger.debug(
+            f"scan window {window.adverts} adverts from {len(window.tags)} tags")
+        target_list = window.summary()
 
         if target_list:
-            logger.info(f"scan resposne length {len(target_list)} ")
-            target_list = await decision(*target_list)
+            logger.info(f"scan resposne tags {len(target_list)} ")
+            #targets already queued or downloading are not offered again
+            target_list = [t for t in target_list if t.mac not in pending]
+            with global_metrics.timer("decision"):
+                target_list = await decision(*target_list)
+        for target in target_list:
+            try:
+                candidates.put_nowait(target)
+            except asyncio.QueueFull:
+                #still advertising next scan if it has data
+                logger.debug(f"candidate queue full, dropping {target}")
+                global_metrics.count("candidates_dropped")
+                break
+            pending.add(target)
         if target_list:
             logger.info(f"target list - {target_list} ")
-            await create_tasks(*target_list, inst=inst)
+        await asyncio.sleep(SCAN_INTERVAL)
 
 
-async def scan(inst: aioserial.AioSerial) -> List[bt_adv.ScanRes]:
+async def scan(inst: aioserial.AioSerial, scan_queue: asyncio.Queue,
+               window: ScanAggregator):
+    """ collect one scan window into window, one record per tag """
+    #discard reports left over from the previous window
+    while not scan_queue.empty():
+        scan_queue.get_nowait()
     await inst.write_async(bt_cmd.get_scan_cmd())
-    ret: List[bt_adv.ScanRes] = []
     while True:
-        resp = (await inst.read_until_async())
+        resp = await scan_queue.get()
         try:
-            adv = bt_adv.handler(resp)
-            ret.append(adv)
+            window.add(bt_adv.handler(resp))
         except AttributeError as e:
             logger.warning(f"scan response attribute warning {e}")
         except bt_adv.ScanTimeout:
             break
-    return ret
 
 
-async def task_main(port, baudrate) -> None:
+async def task_main(port, baudrate, transcript: str = None) -> None:
     inst = aioserial.AioSerial(port=port, baudrate=baudrate, rtscts=True)
-    asyncio.create_task(scan_and_filter(inst))
+    #connect handshakes are serialized, transfers run on up to max_con links at once
+    conn_lock = asyncio.Lock()
+    link_slots = asyncio.Semaphore(get_max_con())
+    candidates = asyncio.Queue(maxsize=CANDIDATE_QUEUE_SIZE)
+    router = Router()
+    #one reader for the whole process, scanning and the links share it
+    reader = UartReader(inst, router, lambda: Bt510Ct.last_conn_mac, transcript)
+    scan_queue = reader.subscribe_scan()
+    pending = set()
+    asyncio.create_task(reader.run())
+    if Bt510Ct.outbox:
+        asyncio.create_task(replay(Bt510Ct.outbox, Bt510Ct.publish_record))
+    _gauges(reader, router, scan_queue, candidates)
+    asyncio.create_task(report(global_metrics, _send_status))
+    asyncio.create_task(scan_and_filter(inst, scan_queue, candidates, pending))
+    asyncio.create_task(
+        download(inst, candidates, router, pending, conn_lock, link_slots))
     while True:
         ## this will allow developers to have a responsive ctr-C
         await asyncio.sleep(1)
+
+
+def _gauges(reader: UartReader, router: Router, scan_queue: asyncio.Queue,
+            candidates: asyncio.Queue):
+    """ the queues and the counters the stages keep themselves, in the metrics """
+    global_metrics.gauge(
+        "uart", lambda: {
+            "lines": reader.reader.lines,
+            "bytes": reader.reader.bytes,
+            "reads": reader.reader.reads,
+            "dropped": dict(reader.dropped)
+        })
+    global_metrics.gauge("router_dropped", lambda: dict(router.dropped))
+    global_metrics.gauge("scan_queue", scan_queue.qsize)
+    global_metrics.gauge("candidates", candidates.qsize)
+    global_metrics.gauge("links", lambda: len(router))
+    if Bt510Ct.publisher:
+        global_metrics.gauge("publisher", Bt510Ct.publisher.stats)
+    if Bt510Ct.outbox:
+        global_metrics.gauge("outbox", lambda: {
+            "pending": Bt510Ct.outbox.pending,
+            "bytes": Bt510Ct.outbox.size()
+        })
+
+
+def _send_status(payload: dict):
+    if Bt510Ct.publisher:
+        #a report never takes the place of a queued log upload
+        Bt510Ct.publisher.submit(Bt510Ct.client.status, payload, policy=DROP_NEWEST)
+    else:
+        Bt510Ct.client.status(payload)
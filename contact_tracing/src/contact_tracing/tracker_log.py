@@ -14,20 +14,67 @@
 import binascii
 import json
 import struct
+import logging
+from .log_file import I8_STR, U8_STR, LogStream, ENTRY_START
+
+logger = logging.getLogger(__name__)
 
 CT_ENTRY_HEADER_SIZE = 16
 CT_ENTRY_LOG_SIZE = 8
 CT_LOG_HEADER_SIZE = 49
 
+CT_LOG_FORMAT = struct.Struct('<BBBHbBb')
+CT_LOG_FIELDS = ('recordType', 'delta', 'rssi', 'motion', 'txPower')
+
+
 class CtLog():
+    """ view of one log row, status and reserved are not part of the output """
+    __slots__ = CT_LOG_FIELDS
+
     def __init__(self, b):
+        self._set(CT_LOG_FORMAT.unpack(b[:CT_ENTRY_LOG_SIZE]))
+
+    @classmethod
+    def from_row(cls, row):
+        log = cls.__new__(cls)
+        log._set(row)
+        return log
+
+    def _set(self, row):
         self.recordType, \
             status, \
             reserved1, \
             self.delta, \
             self.rssi, \
             self.motion, \
-            self.txPower = struct.unpack('<BBBHbBb', b[:CT_ENTRY_LOG_SIZE])
+            self.txPower = row
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in CT_LOG_FIELDS}
+
+
+class CtLogs():
+    """ the logs of one entry, decoded in one pass and kept as rows """
+    __slots__ = ('rows', )
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return CtLog.from_row(self.rows[i])
+
+    def as_list(self):
+        return [{
+            'recordType': t,
+            'delta': delta,
+            'rssi': rssi,
+            'motion': motion,
+            'txPower': tx_power
+        } for (t, _, _, delta, rssi, motion, tx_power) in self.rows]
+
 
 class CtEntry():
     def __init__(self, b):
@@ -40,22 +87,66 @@ class CtEntry():
         # Reverse bytes & convert to hex string
         self.serial = binascii.hexlify(serial_bytes[::-1]).decode('utf-8')
         # Read log entries up to length in header
-        self.logs = []
-        log_offset = CT_ENTRY_HEADER_SIZE
-        while log_offset < self.length and log_offset < len(b):
-            ctlog = CtLog(b[log_offset:])
-            log_offset = log_offset + CT_ENTRY_LOG_SIZE
-            self.logs.append(ctlog)
+        end = min(self.length, len(b))
+        count = max(0, -(-(end - CT_ENTRY_HEADER_SIZE) // CT_ENTRY_LOG_SIZE))
+        self.logs = CtLogs(
+            list(
+                CT_LOG_FORMAT.iter_unpack(
+                    b[CT_ENTRY_HEADER_SIZE:CT_ENTRY_HEADER_SIZE +
+                      count * CT_ENTRY_LOG_SIZE])))
 
     def getLen(self):
         return self.length + 2 # Add CRC length
 
+# CtFile.serialize() writes these, they must stay the same as the CtJsonEncoder output
+CT_FILE_JSON = ('{"entryProtocolVersion": %d, "deviceTime": %d, "lastUploadTime": %d, '
+                '"networkId": %d, "deviceId": "%s", "fwVersion": "%s", '
+                '"batteryLevel": %d, "entries": [%s]}')
+CT_ENTRY_JSON = ('{"entryStart": %d, "flags": %d, "scanInterval": %d, "timestamp": %d, '
+                 '"length": %d, "serial": "%s", "logs": [%s]}')
+# CtFile.pages() writes the first page with the header, the others with entries only
+CT_PAGE_PREFIX = '{"uploadId": "%s", "seq": %d, "total": %d, '
+CT_FIRST_PAGE_JSON = CT_PAGE_PREFIX + CT_FILE_JSON[1:]
+CT_PAGE_JSON = CT_PAGE_PREFIX + '"entries": [%s]}'
+
+
+def logs_json(rows):
+    return ", ".join([
+        f'{{"recordType": {U8_STR[t]}, "delta": {delta}, "rssi": {I8_STR[rssi]}, '
+        f'"motion": {U8_STR[motion]}, "txPower": {I8_STR[tx_power]}}}'
+        for (t, _, _, delta, rssi, motion, tx_power) in rows
+    ])
+
+
 class CtJsonEncoder(json.JSONEncoder):
     def default(self, obj):
+        if isinstance(obj, CtLogs):
+            return obj.as_list()
+        if isinstance(obj, CtLog):
+            return obj.as_dict()
         return obj.__dict__
 
 class CtFile():
     def __init__(self, b):
+        self._header(b)
+        # Read entries until no more data
+        self.entries = []
+        view = memoryview(b)
+        entry_offset = CT_LOG_HEADER_SIZE
+        while entry_offset + CT_ENTRY_HEADER_SIZE <= len(b):
+            entry = CtEntry(view[entry_offset:])
+            self.entries.append(entry)
+            entry_offset = entry_offset + entry.getLen()
+
+    @classmethod
+    def from_parts(cls, header, entries):
+        """ a CtFile that was already parsed, see CtFileStream """
+        ct_file = cls.__new__(cls)
+        ct_file._header(header)
+        ct_file.entries = entries
+        return ct_file
+
+    def _header(self, b):
         self.entryProtocolVersion, \
             max_entry_size, \
             entry_count, \
@@ -81,13 +172,82 @@ class CtFile():
         self.fwVersion = binascii.hexlify(fw_version_bytes).decode('utf-8')
         # Scale battery level to mv
         self.batteryLevel = battery_level * 16
-        # Read entries until no more data
-        self.entries = []
-        entry_offset = CT_LOG_HEADER_SIZE
-        while entry_offset + CT_ENTRY_HEADER_SIZE <= len(b):
-            entry = CtEntry(b[entry_offset:])
-            self.entries.append(entry)
-            entry_offset = entry_offset + entry.getLen()
 
     def serialize(self, indent=None):
+        if indent is None:
+            return self._json()
         return json.dumps(self, cls=CtJsonEncoder, indent=indent)
+
+    def _json(self):
+        # Same document as CtJsonEncoder, written from templates
+        entries = ", ".join([self._entry_json(e) for e in self.entries])
+        return CT_FILE_JSON % (self._header_values() + (entries, ))
+
+    def _header_values(self) -> tuple:
+        return (self.entryProtocolVersion, self.deviceTime,
+                self.lastUploadTime, self.networkId, self.deviceId,
+                self.fwVersion, self.batteryLevel)
+
+    @staticmethod
+    def _entry_json(e) -> str:
+        return CT_ENTRY_JSON % (e.entryStart, e.flags, e.scanInterval,
+                                e.timestamp, e.length, e.serial,
+                                logs_json(e.logs.rows))
+
+    def pages(self, upload_id: str, page_bytes: int):
+        """ the document as messages of at most page_bytes, unless a single entry is
+        bigger. Each has uploadId, seq from 0 and total. The first has the header and
+        the receiver appends the entries of the others to it, in seq order. Only one
+        page is built at a time. """
+        #the entries are written twice, first only to find where the pages end
+        total = max(len(self.entries), 1)
+        room = page_bytes - len(CT_FIRST_PAGE_JSON % (
+            (upload_id, total, total) + self._header_values() + ("", )))
+        starts = [0]
+        size = 0
+        for (i, e) in enumerate(self.entries):
+            length = len(self._entry_json(e)) + 2
+            if size and size + length > room:
+                starts.append(i)
+                room = page_bytes - len(CT_PAGE_JSON % (upload_id, total, total, ""))
+                size = 0
+            size += length
+        starts.append(len(self.entries))
+        total = len(starts) - 1
+        for seq in range(total):
+            entries = ", ".join([
+                self._entry_json(e)
+                for e in self.entries[starts[seq]:starts[seq + 1]]
+            ])
+            if seq == 0:
+                yield CT_FIRST_PAGE_JSON % (
+                    (upload_id, seq, total) + self._header_values() + (entries, ))
+            else:
+                yield CT_PAGE_JSON % (upload_id, seq, total, entries)
+
+
+class CtFileStream(LogStream):
+    """ build a CtFile while the log is downloaded, see LogStream. An entry that is
+    not a header and whole records stops the stream, CtFile then parses the log """
+    def __init__(self):
+        super().__init__()
+        self.header = None
+        self.entries = []
+
+    def _header(self, data):
+        self.header = bytes(data)
+
+    def _entry(self, data, file_index):
+        length = len(data) - 2
+        if data[0] != ENTRY_START or length < CT_ENTRY_HEADER_SIZE or \
+                (length - CT_ENTRY_HEADER_SIZE) % CT_ENTRY_LOG_SIZE:
+            logger.warning(f"log stream lost entry framing @ {hex(file_index)}")
+            self.broken = True
+            return
+        self.entries.append(CtEntry(data))
+
+    def result(self, data):
+        """ the CtFile of data, the complete log that was fed """
+        if not self.is_complete() or self.offset != len(data):
+            return None
+        return CtFile.from_parts(self.header, self.entries)
@@ -0,0 +1,107 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+import os
+import asyncio
+import logging
+import time
+from collections import Counter
+import aioserial
+from line_reader import LineReader
+from .router import Router, LineQueue
+
+logger = logging.getLogger(__name__)
+
+#adverts of one scan window, a full queue drops the newest advert
+SCAN_QUEUE_SIZE = 1024
+#how often the read rates are logged
+STATS_INTERVAL = 60
+#a full transcript is moved to <name>.1, so two of them are kept at most
+TRANSCRIPT_MAX_BYTES = 16 * 1024 * 1024
+#how often the transcript is written out
+TRANSCRIPT_FLUSH_S = 5
+
+
+class UartReader():
+    """ the only reader of the BL654 UART, for the life of the process
+
+    Each line goes to one subscriber: scan reports to the scan queue, connection
+    events and notifications through the router to the queue of their device. All
+    queues are bounded, an advert or notification for a full queue is counted and
+    dropped so one slow consumer cannot stall the others. NOTE: the prefixes are SmartBasic specific """
+    def __init__(self,
+                 inst: aioserial.AioSerial,
+                 router: Router,
+                 connecting,
+                 transcript: str = None):
+        self.inst = inst
+        self.reader = LineReader(inst)
+        self.router = router
+        #returns the MAC being connected
+        self.connecting = connecting
+        self.scan_queue = None
+        self.lines = 0
+        self.dropped = Counter()
+        #every line is appended to the transcript file, for python -m bench
+        self.transcript_path = transcript
+        self.transcript = open(transcript, 'ab') if transcript else None
+        self.flushed = time.monotonic()
+
+    def subscribe_scan(self, maxsize: int = SCAN_QUEUE_SIZE) -> asyncio.Queue:
+        self.scan_queue = LineQueue(maxsize, (b"adv:", ))
+        return self.scan_queue
+
+    async def run(self):
+        logged = time.monotonic()
+        try:
+            while True:
+                self.dispatch(await self.reader.readline())
+                if time.monotonic() - logged > STATS_INTERVAL:
+                    logged = time.monotonic()
+                    logger.debug(f"uart {self.reader.stats()} dropped {dict(self.dropped)}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.transcript:
+            self.transcript.close()
+            self.transcript = None
+
+    def _record(self, raw: bytes):
+        self.transcript.write(raw)
+        if self.transcript.tell() >= TRANSCRIPT_MAX_BYTES:
+            self.transcript.close()
+            os.replace(self.transcript_path, self.transcript_path + ".1")
+            self.transcript = open(self.transcript_path, 'ab')
+            logger.info(f"uart transcript rotated to {self.transcript_path}.1")
+        elif time.monotonic() - self.flushed >= TRANSCRIPT_FLUSH_S:
+            self.transcript.flush()
+            self.flushed = time.monotonic()
+
+    def dispatch(self, raw: bytes):
+        self.lines += 1
+        if self.transcript:
+            self._record(raw)
+        if raw.startswith(b"adv:") or raw.startswith(b"scan:"):
+            self._put(self.scan_queue, raw, "scan")
+            return
+        self.router.route(raw.decode(errors='ignore'), self.connecting())
+
+    def _put(self, queue: LineQueue, raw: bytes, kind: str):
+        if queue is None:
+            self.dropped[kind] += 1
+            return
+        try:
+            #scan:timeout always gets in, an advert makes room for it
+            if queue.put_line(raw) is None:
+                return
+        except asyncio.QueueFull:
+            pass
+        if not self.dropped[kind]:
+            logger.warning(f"{kind} queue full, dropping adverts")
+        self.dropped[kind] += 1
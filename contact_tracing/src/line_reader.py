@@ -0,0 +1,127 @@
+#
+# copyright (c) 2024 Ezurio LLC.
+#
+# SPDX-License-Identifier: Apache-2.0
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License
+# for the specific language governing permissions and limitations
+# under the License.
+import time
+import logging
+import aioserial
+
+logger = logging.getLogger(__name__)
+
+#largest single read from the UART
+MAX_READ = 65536
+
+
+class LineReader():
+    """ read lines from the UART with as few reads as possible
+
+    Each read takes everything that is waiting, one executor round trip instead of one
+    per line with read_until_async. Lines are split from a reused bytearray. """
+    def __init__(self,
+                 inst: aioserial.AioSerial,
+                 terminator: bytes = b"\n",
+                 max_read: int = MAX_READ):
+        self.inst = inst
+        self.terminator = terminator
+        self.max_read = max_read
+        self.buffer = bytearray()
+        self.pos = 0
+        self.bytes = 0
+        self.lines = 0
+        self.reads = 0
+        self._mark = (time.monotonic(), 0, 0)
+
+    async def readline(self) -> bytes:
+        """ the next line with its terminator. A read that times out returns what is
+        left of a partial line, like read_until """
+        while True:
+            end = self.buffer.find(self.terminator, self.pos)
+            if end >= 0:
+                end += len(self.terminator)
+                line = bytes(self.buffer[self.pos:end])
+                self.pos = end
+                self.lines += 1
+                return line
+            del self.buffer[:self.pos]
+            self.pos = 0
+            waiting = min(self.inst.in_waiting, self.max_read)
+            data = await self.inst.read_async(max(1, waiting))
+            self.reads += 1
+            if not data:
+                line = bytes(self.buffer)
+                self.buffer.clear()
+                return line
+            self.bytes += len(data)
+            self.buffer += data
+
+    def stats(self) -> dict:
+        """ totals, and the rates since the last call """
+        now = time.monotonic()
+        (then, lines, count) = self._mark
+        secs = max(now - then, 1e-6)
+        self._mark = (now, self.lines, self.bytes)
+        return {
+            "bytes": self.bytes,
+            "lines": self.lines,
+            "reads": self.reads,
+            "bytes_per_sec": round((self.bytes - count) / secs),
+            "lines_per_sec": round((self.lines - lines) / secs)
+        }
+
+
+if __name__ == "__main__":
+    import asyncio
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+
+    class FakeSerial():
+        """ a loaded UART, reads go through an executor like aioserial """
+        def __init__(self, data: bytes):
+            self.data = io.BytesIO(data)
+            self.size = len(data)
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        @property
+        def in_waiting(self) -> int:
+            return self.size - self.data.tell()
+
+        async def read_async(self, size: int = 1) -> bytes:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.data.read, size)
+
+        async def read_until_async(self, expected: bytes = b"\n") -> bytes:
+            def read_until():
+                line = bytearray()
+                while not line.endswith(expected):
+                    c = self.data.read(1)
+                    if not c:
+                        break
+                    line += c
+                return bytes(line)
+
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, read_until)
+
+    line = b"adv:01CBEC4C68885D 0201061BFF770081FFFFFF01005D88684CECCB00004291365F000000000000 0 -63\n"
+    count = 20000
+
+    async def per_line() -> int:
+        inst = FakeSerial(line * count)
+        for _ in range(count):
+            assert await inst.read_until_async() == line
+
+    async def framed() -> dict:
+        reader = LineReader(FakeSerial(line * count))
+        for _ in range(count):
+            assert await reader.readline() == line
+        return reader.stats()
+
+    for fn in (per_line, framed):
+        start = time.monotonic()
+        stats = asyncio.run(fn())
+        secs = time.monotonic() - start
+        print(f"{fn.__name__:9} {count / secs:9.0f} lines/sec {stats or ''}")
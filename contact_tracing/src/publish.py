@@ -10,8 +10,13 @@ import os
 import json
 import logging
 import base64
+import hashlib
+import time
 from contact_tracing.log_file import DataLog
 from contact_tracing.tracker_log import CtFile
+from contact_tracing.compression import PayloadCompressor
+from contact_tracing.exposure import ExposureSummarizer
+from contact_tracing.metrics import global_metrics
 
 MQTT_BASE = "example/"
 
@@ -30,6 +35,11 @@ def prYellow(skk):
     print("\033[93m {}\033[00m".format(skk))
 
 
+def upload_id(payload, dev_id) -> str:
+    """ the same for every publish of a log, a replay included """
+    return f"{dev_id}-{hashlib.sha1(payload).hexdigest()[:16]}"
+
+
 class Telem():
     def __init__(self):
         self.telem_topic = os.getenv(
@@ -37,6 +47,9 @@ class Telem():
 
         self.status_topic = os.getenv(
             'MQTT_STATUS_TOPIC') or "summit/ig60/{}/ct/status".format(NODE_ID)
+        self.compressor = None
+        self.page_bytes = None
+        self.summarizer = ExposureSummarizer()
 
     def register_status_topic(self, topic):
         self.status_topic = topic
@@ -44,6 +57,44 @@ class Telem():
     def register_telem_topic(self, topic):
         self.telem_topic = topic
 
+    def set_compressor(self, compressor: PayloadCompressor):
+        self.compressor = compressor
+
+    def set_summarizer(self, summarizer: ExposureSummarizer):
+        self.summarizer = summarizer
+
+    def set_page_bytes(self, page_bytes: int):
+        """ publish CtFile documents in pages of at most page_bytes, None for one message """
+        self.page_bytes = page_bytes
+
+    def json_messages(self, payload, dev_id, log=None):
+        """ the CtFile document, or its pages, one at a time """
+        ct_file = log or CtFile(payload)
+        if not self.page_bytes:
+            with global_metrics.timer("serialize", dev_id):
+                resp = self.encode_json(ct_file.serialize())
+            yield resp
+            return
+        pages = ct_file.pages(upload_id(payload, dev_id), self.page_bytes)
+        while True:
+            start = time.monotonic()
+            page = next(pages, None)
+            if page is None:
+                return
+            resp = self.encode_json(page)
+            global_metrics.observe("serialize", time.monotonic() - start, dev_id)
+            yield resp
+
+    def encode_b64(self, payload) -> str:
+        if self.compressor:
+            return self.compressor.envelope(bytes(payload))
+        return json.dumps({"payload": str(base64.b64encode(payload), "ascii")})
+
+    def encode_json(self, doc: str) -> str:
+        if self.compressor:
+            return self.compressor.envelope(doc.encode())
+        return doc
+
 
 class IoTCoreMqttClient(Telem):
     def __init__(self, id = None):
@@ -61,23 +112,30 @@ class IoTCoreMqttClient(Telem):
 
     def publish_b64(self, payload, dev_id):
         topic = self.telem_topic + f"/b64/{dev_id}"
-        s_payload = str(base64.b64encode(payload), "ascii")
-        resp = {"payload": s_payload}
-        self.client.publish(topic=topic, payload=json.dumps(resp))
+        self.client.publish(topic=topic, payload=self.encode_b64(payload))
 
-    def publish_json_legacy(self, payload, dev_id):
+    def publish_json_legacy(self, payload, dev_id, log=None):
         topic = self.telem_topic + f"/json/{dev_id}"
-        resp = DataLog(payload).serialize()
+        with global_metrics.timer("serialize", dev_id):
+            resp = self.encode_json((log or DataLog(payload)).serialize())
         self.client.publish(topic=topic, payload=resp)
 
-    def publish_json(self, payload, dev_id):
+    def publish_json(self, payload, dev_id, log=None):
         topic = self.telem_topic + f"/json/{dev_id}"
-        resp = CtFile(payload).serialize()
-        self.client.publish(topic=topic, payload=resp)
+        for resp in self.json_messages(payload, dev_id, log):
+            self.client.publish(topic=topic, payload=resp)
 
-    def publish_mg100(self, payload, dev_id):
+    def publish_mg100(self, payload, dev_id, log=None):
         topic = f"mg100-ct/dev/gw/{self.id}/up"
-        resp = DataLog(payload).encode_mg100()
+        with global_metrics.timer("serialize", dev_id):
+            resp = (log or DataLog(payload)).encode_mg100()
+        self.client.publish(topic=topic, payload=resp)
+
+    def publish_summary(self, payload, dev_id, log=None):
+        topic = self.telem_topic + f"/summary/{dev_id}"
+        with global_metrics.timer("serialize", dev_id):
+            resp = self.encode_json(
+                self.summarizer.serialize(log or CtFile(payload)))
         self.client.publish(topic=topic, payload=resp)
 
 class LocalPrint(Telem):
@@ -92,18 +150,36 @@ class LocalPrint(Telem):
     def publish_b64(self, payload, dev_id):
         topic = self.telem_topic + f"/b64/{dev_id}"
         try:
-            s_payload = str(base64.b64encode(payload), "ascii")
-            resp = {"ble_scan": s_payload}
+            if self.compressor:
+                resp = self.encode_b64(payload)
+            else:
+                s_payload = str(base64.b64encode(payload), "ascii")
+                resp = {"ble_scan": s_payload}
             prYellow("tag topic: {}, payload: {}".format(topic, resp))
         except Exception as e:
             print(e)
 
-    def publish_json(self, payload, dev_id):
+    def publish_json(self, payload, dev_id, log=None):
         topic = self.telem_topic + f"/json/{dev_id}"
-        resp = DataLog(payload).serialize()
+        if self.page_bytes:
+            for resp in self.json_messages(
+                    payload, dev_id, log if isinstance(log, CtFile) else None):
+                prYellow("tag topic: {}, payload: {}".format(topic, resp))
+            return
+        #the local output has always been the DataLog document
+        if not isinstance(log, DataLog):
+            log = DataLog(payload)
+        resp = self.encode_json(log.serialize())
         prYellow("tag topic: {}, payload: {}".format(topic, resp))
 
-    def publish_mg100(self, payload, dev_id):
+    def publish_mg100(self, payload, dev_id, log=None):
         topic = f"mg100-ct/dev/gw/{self.id}/up"
-        resp = DataLog(payload).encode_mg100()
+        resp = (log or DataLog(payload)).encode_mg100()
+        prYellow("tag topic: {}, payload: {}".format(topic, resp))
+
+    def publish_summary(self, payload, dev_id, log=None):
+        topic = self.telem_topic + f"/summary/{dev_id}"
+        if not isinstance(log, CtFile):
+            log = CtFile(payload)
+        resp = self.encode_json(self.summarizer.serialize(log))
         prYellow("tag topic: {}, payload: {}".format(topic, resp))
@@ -9,6 +9,7 @@
 
 from collections import namedtuple
 import binascii
+import struct
 from construct import Struct,  Byte,  BitStruct, BitsInteger,\
     Flag, Array, Int16ul, Int32ul,  Switch
 import logging
@@ -63,8 +64,44 @@ class ScanTimeout(Exception):
         pass
 
 
+#flags, record type and epoch of the 26 byte CT_ADV record
+CT_ADV_FIELDS = struct.Struct('<6xB7xBxI')
+LOW_BATTERY = 0x08
+HAS_MOTION = 0x04
+HAS_LOG_DATA = 0x02
+HAS_EPOCH_TIME = 0x01
+# offset of the space after the data
+DATA_END = MFG_DATA_OFFSET + RECORD_DATA_SIZE
+
+
 def handler(adv: bytes) -> ScanRes:
-    """ convert the SmartBasic advertisement response to object, with mac, data and rssi """
+    """ convert the SmartBasic advertisement response to object, with mac, data and rssi
+
+    Adverts in the usual layout are decoded with one unhexlify and one struct unpack,
+    anything else goes through construct in handler_construct(). """
+    if len(adv) == ADV_LENGTH_PASSIVE and adv[ADV_DATA_OFFSET] == 32 \
+            and adv[DATA_END] == 32 and adv.startswith(b"adv:") \
+            and adv[4] not in b"adv:" and adv[-1] == 10 and adv.count(b" ") == 3 \
+            and adv.isascii():
+        try:
+            (flags, record_type, epoch) = CT_ADV_FIELDS.unpack_from(
+                binascii.unhexlify(
+                    adv[MFG_DATA_OFFSET:MFG_DATA_OFFSET + RECORD_DATA_SIZE]))
+            return ScanRes(adv[4:ADV_DATA_OFFSET].decode("ascii"),
+                           adv[ADV_DATA_OFFSET + 1:DATA_END].decode("ascii"),
+                           int(adv[adv.rindex(b" ") + 1:]),
+                           epoch if record_type in (AD_TYPE, 0) else 0,
+                           bool(flags & HAS_LOG_DATA),
+                           bool(flags & HAS_EPOCH_TIME),
+                           bool(flags & HAS_MOTION),
+                           bool(flags & LOW_BATTERY))
+        except (binascii.Error, ValueError):
+            pass
+    return handler_construct(adv)
+
+
+def handler_construct(adv: bytes) -> ScanRes:
+    """ handler() using the construct definition, for any advert """
     if len(adv) != ADV_LENGTH_PASSIVE:
         if adv == b"scan:timeout\n":
             raise ScanTimeout()
@@ -92,6 +129,8 @@ def handler(adv: bytes) -> ScanRes:
 
 
 if __name__ == "__main__":
+    import random
+    import timeit
 
     test = [
         b"adv:01CBEC4C68885D 0201061BFF770081FFFFFF01005D88684CECCB00004291365F000000000000 0 -63",
@@ -99,4 +138,34 @@ if __name__ == "__main__":
         b"adv:01D7CB5B96A448 0201061BFF770081FFFFFF010048A4965BCBD700004091365F000000000000 0 -61"
     ]
     for t in test:
-        print(handler(t))
+        print(handler(t + b"\n"))
+
+    def result(fn, adv: bytes):
+        try:
+            return fn(adv)
+        except Exception as e:
+            return type(e)
+
+    #both parsers on random adverts, then on lines damaged in every position
+    rand = random.Random(1)
+    adverts = []
+    for _ in range(2000):
+        mac = "".join(rand.choice("0123456789ABCDEF") for _ in range(14))
+        record = bytes(rand.randrange(256) for _ in range(26))
+        if rand.random() < 0.5:
+            record = record[:14] + bytes([rand.choice((0, AD_TYPE))]) + record[15:]
+        data = "0201061BFF" + record.hex().upper()
+        tail = rand.choice(["0 -63", "1 -99", "0 -7", "12 -5"])
+        adverts.append(f"adv:{mac} {data} {tail}\n".encode())
+    damaged = [
+        a[:i] + bytes([c]) + a[i + 1:] for a in adverts[:20]
+        for i in range(len(a)) for c in b" :aG-\n\xff"
+    ]
+    for adv in adverts + damaged + [b"scan:timeout\n", b"adv:\n"]:
+        assert result(handler, adv) == result(handler_construct, adv), adv
+    print(f"handler matches handler_construct on {len(adverts) + len(damaged)} adverts")
+
+    adverts = [a for a in adverts if len(a) == ADV_LENGTH_PASSIVE]
+    for fn in (handler_construct, handler):
+        secs = timeit.timeit(lambda: [fn(a) for a in adverts], number=5)
+        print(f"{fn.__name__:18} {5 * len(adverts) / secs:10.0f} adverts/sec")